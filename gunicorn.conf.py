@@ -0,0 +1,50 @@
+# Configuration gunicorn de l'API, lancee depuis la racine du projet (chemins des donnees
+# relatifs a celle-ci) : gunicorn -c gunicorn.conf.py wsgi:app
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+pythonpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src')
+bind = os.environ.get('RAILCHECK_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('RAILCHECK_THREADS', '4'))
+timeout = 60
+accesslog = '-'
+# Application importee une fois par le maitre (Flask, NumPy, prometheus_client...) avant de
+# creer les workers par fork : un worker demarre sans rien importer et sert sa premiere requete
+# plus tot. Le code n'est donc pas recharge par un HUP : redemarrer pour un deploiement.
+preload_app = True
+
+# Les workers lisent le CSV a travers une copie .ufmb projetee en memoire, partagee entre eux
+os.environ.setdefault('RAILCHECK_CACHE_PARTAGE', '1')
+# Metriques Prometheus agregees sur tous les workers (repertoire vide a chaque demarrage)
+if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='railcheck-prometheus-')
+    repertoire_temporaire = os.environ['PROMETHEUS_MULTIPROC_DIR']
+else:
+    repertoire_temporaire = None
+
+
+def post_worker_init(worker):
+    # Chargement des donnees dans chaque worker, apres le fork : les threads de fond ne
+    # survivraient pas au fork s'ils etaient demarres par le maitre
+    from api import demarrer_chargement
+    demarrer_chargement()
+
+
+def worker_exit(server, worker):
+    # Etat du suivi enregistre a l'arret : en marche, il ne l'est que periodiquement
+    from api import rafraichisseur
+    rafraichisseur.arreter()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if repertoire_temporaire is not None:
+        shutil.rmtree(repertoire_temporaire, ignore_errors=True)
@@ -0,0 +1,149 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict
+
+import numpy as np
+
+from dataset import Dataset
+
+
+@dataclass
+class Kpis:
+    total_mesures: int
+    pk_min: float
+    pk_max: float
+    anomalies: int
+    compteur_anomalies: Dict[str, int] = field(default_factory=dict)
+    positions_anomalies: Dict[str, np.ndarray] = field(default_factory=dict)
+    hauteur_moyenne: float = 0.0
+    hauteur_min: float = 0.0
+    hauteur_max: float = 0.0
+    hauteur_ecart_type: float = 0.0
+
+    @property
+    def distance_km(self) -> float:
+        return (self.pk_max - self.pk_min) / 1000
+
+    @property
+    def conformite(self) -> float:
+        if self.total_mesures == 0:
+            return 100.0
+        return (self.total_mesures - self.anomalies) / self.total_mesures * 100
+
+
+class AgregatsCourants:
+    # Indicateurs mis a jour lot par lot, en O(lignes ajoutees) : suivi d'un fichier alimente en
+    # continu, resumes du catalogue et KPIs d'un dataset complet (un seul lot) passent tous par
+    # ici. Hauteurs : moyenne et somme des carres des ecarts a la moyenne, combinees d'un lot a
+    # l'autre (Chan et al.) ; somme des carres moins carre de la moyenne perdrait sa precision
+    # sur un long run.
+    def __init__(self):
+        self.total = 0
+        self.pk_min = float('inf')
+        self.pk_max = float('-inf')
+        self.anomalies = 0
+        self.compteur_anomalies: Dict[str, int] = {}
+        self.hauteur_moyenne = 0.0
+        self.hauteur_ecarts_carres = 0.0
+        self.hauteur_min = float('inf')
+        self.hauteur_max = float('-inf')
+
+    def _combiner_hauteurs(self, nombre: int, moyenne: float, ecarts_carres: float) -> None:
+        # A appeler avant de mettre a jour self.total
+        total = self.total + nombre
+        ecart = moyenne - self.hauteur_moyenne
+        self.hauteur_moyenne += ecart * nombre / total
+        self.hauteur_ecarts_carres += ecarts_carres + ecart * ecart * self.total * nombre / total
+
+    def ajouter(self, colonnes: Dict[str, np.ndarray], types_anomalies) -> None:
+        nombre = len(colonnes['pk_position'])
+        if nombre == 0:
+            return
+        pk = colonnes['pk_position']
+        hauteurs = colonnes['hauteur_catenaire']
+        codes = colonnes['defaut_type']
+
+        moyenne = float(hauteurs.mean())
+        ecarts = hauteurs - moyenne
+        self._combiner_hauteurs(nombre, moyenne, float(np.dot(ecarts, ecarts)))
+        self.total += nombre
+        self.pk_min = min(self.pk_min, float(pk.min()))
+        self.pk_max = max(self.pk_max, float(pk.max()))
+        compteur = np.bincount(codes[codes >= 0], minlength=len(types_anomalies))
+        for type_anomalie, nombre_type in zip(types_anomalies, compteur.tolist()):
+            if nombre_type:
+                self.compteur_anomalies[type_anomalie] = \
+                    self.compteur_anomalies.get(type_anomalie, 0) + nombre_type
+        self.anomalies += int(compteur.sum())
+        self.hauteur_min = min(self.hauteur_min, float(hauteurs.min()))
+        self.hauteur_max = max(self.hauteur_max, float(hauteurs.max()))
+
+    def fusionner(self, autre: 'AgregatsCourants') -> None:
+        # Agregats d'un autre fichier (ou d'une autre partie du meme) : moments, extremes et
+        # comptages se combinent sans relire les mesures
+        if autre.total == 0:
+            return
+        self._combiner_hauteurs(autre.total, autre.hauteur_moyenne, autre.hauteur_ecarts_carres)
+        self.total += autre.total
+        self.pk_min = min(self.pk_min, autre.pk_min)
+        self.pk_max = max(self.pk_max, autre.pk_max)
+        self.anomalies += autre.anomalies
+        for type_anomalie, nombre_type in autre.compteur_anomalies.items():
+            self.compteur_anomalies[type_anomalie] = \
+                self.compteur_anomalies.get(type_anomalie, 0) + nombre_type
+        self.hauteur_min = min(self.hauteur_min, autre.hauteur_min)
+        self.hauteur_max = max(self.hauteur_max, autre.hauteur_max)
+
+    def etat(self) -> Dict[str, Any]:
+        # Serialisable en JSON (.agregats.npz du suivi, .resume.json du catalogue)
+        return dict(vars(self))
+
+    @classmethod
+    def depuis_etat(cls, etat: Dict[str, Any]) -> 'AgregatsCourants':
+        # KeyError si l'etat a ete enregistre par une version aux champs differents : il est
+        # alors recalcule a partir du fichier
+        agregats = cls()
+        if set(etat) != set(vars(agregats)):
+            raise KeyError('agregats')
+        vars(agregats).update(etat)
+        return agregats
+
+    def kpis(self) -> Kpis:
+        if self.total == 0:
+            return Kpis(0, 0.0, 0.0, 0)
+        return Kpis(
+            total_mesures=self.total,
+            pk_min=self.pk_min,
+            pk_max=self.pk_max,
+            anomalies=self.anomalies,
+            compteur_anomalies=dict(self.compteur_anomalies),
+            hauteur_moyenne=self.hauteur_moyenne,
+            hauteur_min=self.hauteur_min,
+            hauteur_max=self.hauteur_max,
+            hauteur_ecart_type=(self.hauteur_ecarts_carres / self.total) ** 0.5,
+        )
+
+
+def calculer_kpis(dataset: Dataset) -> Kpis:
+    # Tous les indicateurs d'un dataset : memes agregats que le suivi de l'API, plus les
+    # positions des anomalies (graphiques de l'interface)
+    agregats = AgregatsCourants()
+    agregats.ajouter(dataset.colonnes, dataset.types_anomalies)
+    kpis = agregats.kpis()
+    if kpis.anomalies == 0:
+        return kpis
+
+    # Positions des anomalies regroupees par type (tri stable : ordre des PK conserve)
+    codes = dataset['defaut_type']
+    lignes_anomalies = np.flatnonzero(codes >= 0)
+    codes_anomalies = codes[lignes_anomalies]
+    ordre = np.argsort(codes_anomalies, kind='stable')
+    compteur = np.bincount(codes_anomalies, minlength=len(dataset.types_anomalies))
+    positions = np.split(dataset['pk_position'][lignes_anomalies[ordre]], np.cumsum(compteur)[:-1])
+    kpis.positions_anomalies = {nom: positions_type
+                                for nom, nombre, positions_type
+                                in zip(dataset.types_anomalies, compteur, positions) if nombre}
+    return kpis
+
+
+def obtenir_kpis(dataset: Dataset) -> Kpis:
+    return dataset.calculer('kpis', calculer_kpis)
@@ -1,104 +1,452 @@
-from flask import Flask, jsonify
-import csv
-from prometheus_client import Counter, Gauge, generate_latest, CONTENT_TYPE_LATEST
+import os
+import json
+import threading
+
+import numpy as np
+from flask import Flask, jsonify, request, url_for
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 from flask import Response
 
+from dataset import charger_dataset
+from index_pk import sous_dataset, resumer_segments, lister_anomalies, obtenir_index_anomalies
+from data_generator import Gravite, gravite_libelle
+from segments import SEGMENTS_MAX
+from echantillonnage import POINTS_SERIE, METHODES, reduire_serie
+from ingestion import SuiviFichier, Rafraichisseur
+from metriques import installer_instrumentation
+from cache_http import CacheReponses
+from catalogue import Catalogue, selectionner, fusionner, version_selection
+from depassements import COLONNES_SURVEILLEES, TYPES_REGLES, EVENEMENTS_MAX, depassement_json
+
 app = Flask(__name__)
+installer_instrumentation(app)
+
+INTERVALLE_RAFRAICHISSEMENT = float(os.environ.get('RAILCHECK_INTERVALLE_RAFRAICHISSEMENT', '1.0'))
+LIMITE_MESURES_PLAGE = 10000  # mesures detaillees renvoyees au plus par /range
+POINTS_SERIE_MAX = 100000
+LIMITE_ANOMALIES = 1000  # anomalies par page de /anomalies/list par defaut
+ANOMALIES_PAGE_MAX = 100000
+ANOMALIES_PAR_MORCEAU = 1000  # anomalies serialisees par morceau de reponse
+LIMITE_DEPASSEMENTS = 1000  # depassements renvoyes par defaut par /breaches (les plus recents)
+
+# Les agregats sont recalcules dans un thread de fond a partir des seules lignes ajoutees
+# au fichier ; les routes et /metrics lisent le dernier instantane publie
+rafraichisseur = Rafraichisseur(SuiviFichier(), INTERVALLE_RAFRAICHISSEMENT)
+
+# Corps JSON memoises par version des donnees, avec ETag / 304 pour les clients qui interrogent
+# en boucle (Grafana, tableaux de bord)
+reponses = CacheReponses()
+
+def instantane_courant():
+    rafraichisseur.demarrer()
+    return rafraichisseur.instantane
+
+def kpis_courants():
+    return instantane_courant().kpis
+
+def servir_instantane(fabriquer):
+    # Reponse calculee a partir d'un seul instantane, memoisee tant que les agregats n'ont pas change
+    instantane = instantane_courant()
+    return reponses.servir(instantane.version, instantane.modification, lambda: fabriquer(instantane))
+
+def servir_dataset(dataset, fabriquer):
+    mtime_ns, taille = dataset.version
+    return reponses.servir(f"{mtime_ns:x}-{taille:x}", mtime_ns / 1e9, lambda: fabriquer(dataset))
+
+# Runs d'inspection de data/raw (un fichier par passage), resumes une fois et gardes sur disque
+catalogue = Catalogue()
+
+def dataset_demande():
+    # Run choisi par le parametre `run` (nom de fichier du catalogue), sinon le fichier suivi.
+    # KeyError si le run n'existe pas, ValueError si une ligne est illisible (fichier en cours
+    # de reecriture) : les routes repondent 503, un nouvel essai peut reussir
+    nom = request.args.get('run')
+    return charger_dataset(catalogue.chemin(nom) if nom else None)
 
-# Metriques Prometheus
-mesures_total = Gauge('railcheck_mesures_total', 'Nombre total de mesures')
-distance_km = Gauge('railcheck_distance_km', 'Distance inspectee en km')
-anomalies_total = Gauge('railcheck_anomalies_total', 'Nombre total anomalies')
-conformite_taux = Gauge('railcheck_conformite_taux', 'Taux de conformite en pourcentage')
+def runs_demandes():
+    # ValueError si une date est illisible
+    return selectionner(catalogue.runs(), request.args.get('debut'), request.args.get('fin'),
+                        request.args.get('ligne'))
+
+def run_json(resume):
+    kpis = resume.kpis()
+    return {
+        'run': resume.nom,
+        'ligne': resume.ligne,
+        'debut': resume.debut,
+        'fin': resume.fin,
+        'total_mesures': kpis.total_mesures,
+        'distance_km': round(kpis.distance_km, 2),
+        'anomalies': kpis.anomalies,
+        'conformite': round(kpis.conformite, 2),
+    }
+
+def segment_json(segment):
+    return {
+        'pk_debut': segment.pk_debut,
+        'mesures': segment.mesures,
+        'anomalies': segment.anomalies,
+        'compteur_anomalies': segment.compteur_anomalies,
+        'compteur_gravites': segment.compteur_gravites,
+        'hauteur_moyenne': round(segment.hauteur_moyenne, 2),
+        'hauteur_min': round(segment.hauteur_min, 2),
+        'hauteur_max': round(segment.hauteur_max, 2),
+    }
+
+class CollecteurKpis:
+    # Metriques Prometheus lues dans un meme instantane au moment du scrape
+    def collect(self):
+        kpis = rafraichisseur.instantane.kpis
+        yield GaugeMetricFamily('railcheck_mesures_total', 'Nombre total de mesures',
+                                value=kpis.total_mesures)
+        yield GaugeMetricFamily('railcheck_distance_km', 'Distance inspectee en km',
+                                value=round(kpis.distance_km, 2))
+        yield GaugeMetricFamily('railcheck_anomalies_total', 'Nombre total anomalies',
+                                value=kpis.anomalies)
+        yield GaugeMetricFamily('railcheck_conformite_taux', 'Taux de conformite en pourcentage',
+                                value=round(kpis.conformite, 2))
+        yield GaugeMetricFamily('railcheck_donnees_age_secondes',
+                                'Secondes depuis le dernier rafraichissement des agregats',
+                                value=rafraichisseur.age())
+        depassements = CounterMetricFamily('railcheck_depassements',
+                                           'Depassements de tolerance detectes depuis le debut du fichier',
+                                           labels=['colonne', 'regle'])
+        for (colonne, regle), nombre in sorted(rafraichisseur.instantane.depassements.compteurs.items()):
+            depassements.add_metric([colonne, regle], nombre)
+        yield depassements
+
+collecteur_kpis = CollecteurKpis()
+REGISTRY.register(collecteur_kpis)
+
+def registre_metriques():
+    # Sous gunicorn (PROMETHEUS_MULTIPROC_DIR defini), compteurs et histogrammes sont
+    # agreges sur tous les workers ; les KPIs viennent de l'instantane du worker interroge
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registre = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registre)
+    registre.register(collecteur_kpis)
+    return registre
+
+# Pret = dataset en cache et premier instantane des agregats publie
+pret = threading.Event()
+erreur_chargement = None
+verrou_chargement = threading.Lock()
+thread_chargement = None
+
+def _charger_en_fond():
+    global erreur_chargement
+    while not pret.is_set():
+        try:
+            rafraichisseur.demarrer()
+            charger_dataset()
+            if rafraichisseur.instantane.horodatage is None:
+                raise rafraichisseur.derniere_erreur or RuntimeError("agregats non disponibles")
+        except (OSError, ValueError, RuntimeError) as erreur:
+            # Fichier de mesures pas encore present : nouvel essai a l'intervalle suivant
+            erreur_chargement = erreur
+            pret.wait(INTERVALLE_RAFRAICHISSEMENT)
+        else:
+            erreur_chargement = None
+            pret.set()
+
+def demarrer_chargement():
+    # Charge les donnees sans bloquer le demarrage du serveur ; /ready repond 200 ensuite
+    global thread_chargement
+    with verrou_chargement:
+        if thread_chargement is None:
+            thread_chargement = threading.Thread(target=_charger_en_fond, name='railcheck-chargement',
+                                                 daemon=True)
+            thread_chargement.start()
 
 @app.route('/stats')
 def get_stats():
-    fichier = open('data/raw/mesures_ufm160.csv', 'r', encoding='utf-8')
-    reader = csv.DictReader(fichier)
-    
-    total = 0
-    anomalies = 0
-    pk_min = 999999
-    pk_max = 0
-    
-    for ligne in reader:
-        total = total + 1
-        if ligne['defaut_type']:
-            anomalies = anomalies + 1
-        
-        pk = float(ligne['pk_position'])
-        if pk < pk_min:
-            pk_min = pk
-        if pk > pk_max:
-            pk_max = pk
-    
-    fichier.close()
-    
-    distance = (pk_max - pk_min) / 1000
-    conformite = (total - anomalies) / total * 100
-    
-    # Mettre a jour les metriques Prometheus
-    mesures_total.set(total)
-    distance_km.set(round(distance, 2))
-    anomalies_total.set(anomalies)
-    conformite_taux.set(round(conformite, 2))
-    
-    return jsonify({
-        'total_mesures': total,
-        'distance_km': round(distance, 2),
-        'anomalies': anomalies,
-        'conformite': round(conformite, 2)
-    })
+    def corps(instantane):
+        kpis = instantane.kpis
+        return {
+            'total_mesures': kpis.total_mesures,
+            'distance_km': round(kpis.distance_km, 2),
+            'anomalies': kpis.anomalies,
+            'conformite': round(kpis.conformite, 2)
+        }
+    return servir_instantane(corps)
 
 @app.route('/anomalies')
 def get_anomalies():
-    fichier = open('data/raw/mesures_ufm160.csv', 'r', encoding='utf-8')
-    reader = csv.DictReader(fichier)
-    
-    compteur = {}
-    
-    for ligne in reader:
-        if ligne['defaut_type']:
-            type_anomalie = ligne['defaut_type']
-            if type_anomalie in compteur:
-                compteur[type_anomalie] = compteur[type_anomalie] + 1
+    return servir_instantane(lambda instantane: instantane.kpis.compteur_anomalies)
+
+def liste_demandee(nom):
+    # Parametre repetable ou separe par des virgules (?type=a,b ou ?type=a&type=b), None si absent
+    valeurs = [valeur for brut in request.args.getlist(nom) for valeur in brut.split(',') if valeur]
+    return valeurs or None
+
+def anomalies_json(dataset, lignes):
+    # Une page d'anomalies, lue colonne par colonne pour les seules lignes de la page
+    types = dataset.types_anomalies
+    return [
+        {'pk': round(float(pk), 3), 'timestamp': str(timestamp), 'type': types[code],
+         'gravite': gravite_libelle(types[code]), 'position': round(float(position), 3)}
+        for pk, timestamp, code, position in zip(dataset['pk_position'][lignes],
+                                                 dataset['timestamp'][lignes],
+                                                 dataset['defaut_type'][lignes],
+                                                 dataset['defaut_position'][lignes])
+    ]
+
+@app.route('/anomalies/list')
+def get_anomalies_list():
+    # Anomalies une a une, par pages, dans l'ordre des PK. Le curseur `apres` est renvoye dans
+    # `suivant` (et l'en-tete Link) ; il reste valable quand des mesures sont ajoutees au fichier
+    try:
+        pk_min = float(request.args.get('pk_min', '-inf'))
+        pk_max = float(request.args.get('pk_max', 'inf'))
+        limite = int(request.args.get('limite', LIMITE_ANOMALIES))
+        apres = int(request.args['apres']) if 'apres' in request.args else None
+    except ValueError:
+        return jsonify({'erreur': 'parametres numeriques attendus'}), 400
+    types = liste_demandee('type')
+    gravites = liste_demandee('gravite')
+    format_reponse = request.args.get('format', 'json')
+    if not 1 <= limite <= ANOMALIES_PAGE_MAX:
+        return jsonify({'erreur': f'limite doit etre entre 1 et {ANOMALIES_PAGE_MAX}'}), 400
+    if format_reponse not in ('json', 'ndjson'):
+        return jsonify({'erreur': 'format doit etre json ou ndjson'}), 400
+    connues = sorted(gravite.value for gravite in Gravite)
+    if gravites is not None and not set(gravites) <= set(connues):
+        return jsonify({'erreur': f"gravite doit etre parmi {', '.join(connues)}"}), 400
+    try:
+        dataset = dataset_demande()
+    except KeyError:
+        return jsonify({'erreur': 'run inconnu'}), 404
+    except ValueError as erreur:
+        return jsonify({'erreur': f"fichier de mesures illisible : {erreur}"}), 503
+    index = obtenir_index_anomalies(dataset)
+    if types is not None and not set(types) <= set(dataset.types_anomalies):
+        return jsonify({'erreur': f"type doit etre parmi {', '.join(dataset.types_anomalies)}"}), 400
+    try:
+        lignes, total, suivant = index.page(index.codes(types, gravites), pk_min, pk_max, apres, limite)
+    except IndexError:
+        return jsonify({'erreur': 'curseur invalide'}), 400
+
+    def fabriquer():
+        entetes = {'X-Total-Count': str(total)}
+        if suivant is not None:
+            arguments = request.args.to_dict(flat=False)
+            arguments['apres'] = [str(suivant)]
+            entetes['Link'] = f'<{url_for(request.endpoint, **arguments)}>; rel="next"'
+        return morceaux(), entetes
+
+    def morceaux():
+        # Serialisation par morceaux : la page n'existe jamais en entier sous forme de texte
+        if format_reponse == 'json':
+            curseur = json.dumps(None if suivant is None else str(suivant))
+            yield f'{{"total":{total},"suivant":{curseur},"anomalies":['
+        for debut in range(0, len(lignes), ANOMALIES_PAR_MORCEAU):
+            anomalies = anomalies_json(dataset, lignes[debut:debut + ANOMALIES_PAR_MORCEAU])
+            if format_reponse == 'ndjson':
+                yield ''.join(json.dumps(anomalie, separators=(',', ':')) + '\n' for anomalie in anomalies)
             else:
-                compteur[type_anomalie] = 1
-    
-    fichier.close()
-    
-    return jsonify(compteur)
+                yield (',' if debut else '') + ','.join(json.dumps(anomalie, separators=(',', ':'))
+                                                        for anomalie in anomalies)
+        if format_reponse == 'json':
+            yield ']}'
+
+    mtime_ns, taille = dataset.version
+    return reponses.servir_flux(f"{mtime_ns:x}-{taille:x}", mtime_ns / 1e9, fabriquer,
+                                'application/x-ndjson' if format_reponse == 'ndjson' else 'application/json')
 
 @app.route('/hauteurs')
 def get_hauteurs():
-    fichier = open('data/raw/mesures_ufm160.csv', 'r', encoding='utf-8')
-    reader = csv.DictReader(fichier)
-    
-    hauteurs = []
-    for ligne in reader:
-        hauteurs.append(float(ligne['hauteur_catenaire']))
-    
-    fichier.close()
-    
-    somme = 0
-    for h in hauteurs:
-        somme = somme + h
-    moyenne = somme / len(hauteurs)
-    
-    hauteur_min = min(hauteurs)
-    hauteur_max = max(hauteurs)
-    
+    def corps(instantane):
+        kpis = instantane.kpis
+        return {
+            'moyenne': round(kpis.hauteur_moyenne, 2),
+            'min': round(kpis.hauteur_min, 2),
+            'max': round(kpis.hauteur_max, 2),
+            'ecart_type': round(kpis.hauteur_ecart_type, 3),
+            'total_mesures': kpis.total_mesures
+        }
+    return servir_instantane(corps)
+
+@app.route('/hauteurs/series')
+def get_hauteurs_series():
+    try:
+        pk_min = float(request.args.get('pk_min', '-inf'))
+        pk_max = float(request.args.get('pk_max', 'inf'))
+        points = int(request.args.get('points', POINTS_SERIE))
+    except ValueError:
+        return jsonify({'erreur': 'parametres numeriques attendus'}), 400
+    methode = request.args.get('methode', 'minmax')
+    if not 3 <= points <= POINTS_SERIE_MAX:
+        return jsonify({'erreur': f'points doit etre entre 3 et {POINTS_SERIE_MAX}'}), 400
+    if methode not in METHODES:
+        return jsonify({'erreur': f"methode doit etre parmi {', '.join(METHODES)}"}), 400
+
+    def reduire(donnees):
+        return reduire_serie(donnees['pk_position'], donnees['hauteur_catenaire'], points, methode)
+
+    def corps(dataset):
+        if 'pk_min' in request.args or 'pk_max' in request.args:
+            dataset = sous_dataset(dataset, pk_min, pk_max)
+            pk, hauteurs = reduire(dataset)
+        elif points == POINTS_SERIE:
+            # Serie complete par defaut : reduite une fois par version du fichier
+            pk, hauteurs = dataset.calculer(f'serie_{methode}', reduire)
+        else:
+            pk, hauteurs = reduire(dataset)
+        return {
+            'methode': methode,
+            'total_mesures': len(dataset),
+            'pk': np.round(pk, 3).tolist(),
+            'hauteur': np.round(hauteurs, 2).tolist(),
+        }
+    try:
+        dataset = dataset_demande()
+    except KeyError:
+        return jsonify({'erreur': 'run inconnu'}), 404
+    except ValueError as erreur:
+        return jsonify({'erreur': f"fichier de mesures illisible : {erreur}"}), 503
+    return servir_dataset(dataset, corps)
+
+@app.route('/range')
+def get_range():
+    try:
+        pk_min = float(request.args['pk_min'])
+        pk_max = float(request.args['pk_max'])
+        limite = int(request.args.get('limite', LIMITE_MESURES_PLAGE))
+    except (KeyError, ValueError):
+        return jsonify({'erreur': 'pk_min et pk_max (en metres) sont requis'}), 400
+    if pk_min > pk_max or limite < 0:
+        return jsonify({'erreur': 'fenetre invalide'}), 400
+
+    try:
+        dataset = dataset_demande()
+    except KeyError:
+        return jsonify({'erreur': 'run inconnu'}), 404
+    except ValueError as erreur:
+        return jsonify({'erreur': f"fichier de mesures illisible : {erreur}"}), 503
+    plage = sous_dataset(dataset, pk_min, pk_max)
+    mesures = {nom: colonne[:limite] for nom, colonne in plage.colonnes.items()}
     return jsonify({
-        'moyenne': round(moyenne, 2),
-        'min': round(hauteur_min, 2),
-        'max': round(hauteur_max, 2),
-        'total_mesures': len(hauteurs)
+        'pk_min': pk_min,
+        'pk_max': pk_max,
+        'total_mesures': len(plage),
+        'mesures': [
+            {'timestamp': str(timestamp), 'pk': round(float(pk), 3), 'vitesse': int(vitesse),
+             'hauteur': round(float(hauteur), 2)}
+            for timestamp, pk, vitesse, hauteur in zip(mesures['timestamp'], mesures['pk_position'],
+                                                      mesures['vitesse'], mesures['hauteur_catenaire'])
+        ],
+        'anomalies': lister_anomalies(plage),
+        'segments': [segment_json(segment) for segment in resumer_segments(plage)],
     })
 
+@app.route('/segments')
+def get_segments():
+    # Servi par la pyramide de segments du dernier instantane, sans relire les mesures
+    try:
+        pk_min = float(request.args.get('pk_min', '-inf'))
+        pk_max = float(request.args.get('pk_max', 'inf'))
+        longueur = float(request.args['niveau']) if 'niveau' in request.args else None
+        segments_max = int(request.args.get('segments', SEGMENTS_MAX))
+    except ValueError:
+        return jsonify({'erreur': 'parametres numeriques attendus'}), 400
+
+    instantane = instantane_courant()
+    pyramide = instantane.pyramide
+    try:
+        niveau = pyramide.niveau(longueur, pk_min, pk_max, segments_max)
+    except ValueError as erreur:
+        return jsonify({'erreur': str(erreur)}), 400
+    return reponses.servir(instantane.version, instantane.modification, lambda: {
+        'niveau': niveau.longueur,
+        'segments': [segment_json(segment) for segment in pyramide.resumer(niveau, pk_min, pk_max)],
+    })
+
+@app.route('/breaches')
+def get_breaches():
+    # Depassements de tolerance detectes a l'ingestion, du plus ancien au plus recent
+    try:
+        pk_min = float(request.args.get('pk_min', '-inf'))
+        pk_max = float(request.args.get('pk_max', 'inf'))
+        limite = int(request.args.get('limite', LIMITE_DEPASSEMENTS))
+    except ValueError:
+        return jsonify({'erreur': 'parametres numeriques attendus'}), 400
+    colonne = request.args.get('colonne')
+    regle = request.args.get('regle')
+    if not 0 <= limite <= EVENEMENTS_MAX:
+        return jsonify({'erreur': f'limite doit etre entre 0 et {EVENEMENTS_MAX}'}), 400
+    if colonne is not None and colonne not in COLONNES_SURVEILLEES:
+        return jsonify({'erreur': f"colonne doit etre parmi {', '.join(COLONNES_SURVEILLEES)}"}), 400
+    if regle is not None and regle not in TYPES_REGLES:
+        return jsonify({'erreur': f"regle doit etre parmi {', '.join(TYPES_REGLES)}"}), 400
+
+    def corps(instantane):
+        depassements = instantane.depassements
+        evenements = depassements.filtrer(pk_min, pk_max, colonne, regle)
+        return {
+            'total': depassements.total,
+            'compteurs': [{'colonne': colonne_compteur, 'regle': regle_compteur, 'total': nombre}
+                          for (colonne_compteur, regle_compteur), nombre
+                          in sorted(depassements.compteurs.items())],
+            'selection': len(evenements),
+            'depassements': [depassement_json(evenement)
+                             for evenement in evenements[len(evenements) - limite:]],
+        }
+    return servir_instantane(corps)
+
+@app.route('/runs')
+def get_runs():
+    try:
+        resumes = runs_demandes()
+    except ValueError:
+        return jsonify({'erreur': 'dates attendues au format AAAA-MM-JJ[THH:MM:SS]'}), 400
+    return reponses.servir(version_selection(resumes), None,
+                           lambda: {'runs': [run_json(resume) for resume in resumes]})
+
+@app.route('/runs/stats')
+def get_runs_stats():
+    # KPIs de flotte : agregats partiels des runs selectionnes, fusionnes sans relire les mesures
+    try:
+        resumes = runs_demandes()
+    except ValueError:
+        return jsonify({'erreur': 'dates attendues au format AAAA-MM-JJ[THH:MM:SS]'}), 400
+
+    def corps():
+        kpis = fusionner(resumes).kpis()
+        return {
+            'runs': len(resumes),
+            'total_mesures': kpis.total_mesures,
+            # Runs distincts : les distances s'additionnent, les PK ne se comparent pas
+            'distance_km': round(sum(resume.kpis().distance_km for resume in resumes), 2),
+            'anomalies': kpis.anomalies,
+            'conformite': round(kpis.conformite, 2),
+            'compteur_anomalies': kpis.compteur_anomalies,
+            'hauteurs': {
+                'moyenne': round(kpis.hauteur_moyenne, 2),
+                'min': round(kpis.hauteur_min, 2),
+                'max': round(kpis.hauteur_max, 2),
+                'ecart_type': round(kpis.hauteur_ecart_type, 3),
+            },
+        }
+    return reponses.servir(version_selection(resumes), None, corps)
+
+@app.route('/health')
+def health():
+    return jsonify({'statut': 'ok'})
+
+@app.route('/ready')
+def ready():
+    demarrer_chargement()
+    if not pret.is_set():
+        return jsonify({'pret': False, 'erreur': str(erreur_chargement or 'chargement en cours')}), 503
+    return jsonify({'pret': True, 'total_mesures': kpis_courants().total_mesures})
+
 @app.route('/metrics')
 def metrics():
-    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+    rafraichisseur.demarrer()
+    return Response(generate_latest(registre_metriques()), mimetype=CONTENT_TYPE_LATEST)
 
 if __name__ == '__main__':
+    # Serveur de developpement ; en production : gunicorn -c gunicorn.conf.py wsgi:app
     app.run(debug=True, host='0.0.0.0', port=5000)
-
@@ -0,0 +1,702 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime, timedelta
+
+import data_generator
+
+DEBUT = datetime(2024, 1, 15, 8, 0)
+MESURES_PAR_HEURE = 3600 / data_generator.INTERVALLE_MESURE
+
+
+def chronometrer(fonction, repetitions=1):
+    # Meilleur temps sur plusieurs repetitions (secondes)
+    meilleur = None
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        fonction()
+        duree = time.perf_counter() - debut
+        if meilleur is None or duree < meilleur:
+            meilleur = duree
+    return meilleur
+
+
+def bench_generation(lignes, repetitions, comparer):
+    duree_heures = lignes / MESURES_PAR_HEURE
+    dossier = tempfile.mkdtemp()
+    chemin = os.path.join(dossier, 'mesures_bench.csv')
+
+    vectorise = chronometrer(lambda: data_generator.generer_donnees_ufm160(
+        DEBUT, duree_heures, chemin, graine=42), repetitions)
+    print(f"generation vectorisee : {lignes} lignes en {vectorise:.3f} s "
+          f"({lignes / vectorise:,.0f} lignes/s)")
+
+    if comparer:
+        ligne_a_ligne = chronometrer(lambda: data_generator.generer_donnees_ufm160(
+            DEBUT, duree_heures, chemin, graine=42, vectorise=False))
+        print(f"generation ligne a ligne : {lignes} lignes en {ligne_a_ligne:.3f} s "
+              f"({lignes / ligne_a_ligne:,.0f} lignes/s)")
+        print(f"acceleration : x{ligne_a_ligne / vectorise:.1f}")
+
+    shutil.rmtree(dossier)
+
+
+def _pic_memoire_generation(duree_heures, chemin):
+    # Execute dans un processus neuf : ru_maxrss ne reflete que cette generation (Ko sous Linux)
+    data_generator.ecrire_mesures(data_generator.iter_mesures(DEBUT, duree_heures, graine=42),
+                                  data_generator.SortieCsv(chemin))
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_memoire(durees):
+    dossier = tempfile.mkdtemp()
+    chemin = os.path.join(dossier, 'mesures_bench.csv')
+    contexte = multiprocessing.get_context('spawn')
+
+    for duree_heures in durees:
+        with contexte.Pool(1) as pool:
+            pic_ko = pool.apply(_pic_memoire_generation, (duree_heures, chemin))
+        lignes = data_generator.nombre_mesures(duree_heures)
+        print(f"{duree_heures:g} h ({lignes} lignes) : pic RSS {pic_ko / 1024:.1f} Mo, "
+              f"fichier {os.path.getsize(chemin) / 1024 ** 2:.0f} Mo")
+        os.remove(chemin)
+
+    shutil.rmtree(dossier)
+
+
+def bench_parallele(lignes, liste_workers):
+    duree_heures = lignes / MESURES_PAR_HEURE
+    dossier = tempfile.mkdtemp()
+    chemin = os.path.join(dossier, 'mesures_bench.csv')
+
+    reference = None
+    for workers in liste_workers:
+        duree = chronometrer(lambda: data_generator.generer_donnees_paralleles(
+            DEBUT, duree_heures, chemin, graine=42, workers=workers))
+        reference = reference or duree * workers
+        print(f"{workers} workers : {lignes} lignes en {duree:.3f} s "
+              f"({lignes / duree:,.0f} lignes/s, efficacite {reference / duree / workers:.0%})")
+        os.remove(chemin)
+
+    shutil.rmtree(dossier)
+
+
+def bench_api(lignes, repetitions):
+    import dataset
+    import api
+
+    dossier = tempfile.mkdtemp()
+    dataset.CHEMIN_MESURES = os.path.join(dossier, 'mesures_bench.csv')
+    data_generator.generer_donnees_ufm160(DEBUT, lignes / MESURES_PAR_HEURE,
+                                          dataset.CHEMIN_MESURES, graine=42)
+    client = api.app.test_client()
+
+    for route in ('/stats', '/anomalies', '/hauteurs'):
+        dataset.cache.vider()
+        froid = chronometrer(lambda: client.get(route))
+        chaud = chronometrer(lambda: client.get(route), repetitions)
+        print(f"{route} : {lignes} lignes, premier appel {froid * 1000:.1f} ms, "
+              f"cache chaud {chaud * 1000:.2f} ms")
+
+    # Le rafraichisseur suit le fichier et y ajoute son etat (.agregats.npz)
+    api.rafraichisseur.arreter()
+    shutil.rmtree(dossier)
+
+
+def bench_suivi(lots, taille_lot):
+    import ingestion
+
+    dossier = tempfile.mkdtemp()
+    chemin = os.path.join(dossier, 'mesures_bench.csv')
+    suivi = ingestion.SuiviFichier(chemin)
+
+    with data_generator.SortieCsv(chemin) as sortie:
+        lots_generes = data_generator.iter_mesures(DEBUT, lots * taille_lot / MESURES_PAR_HEURE,
+                                                   taille_lot=taille_lot, graine=42)
+        for numero, lot in enumerate(lots_generes, 1):
+            sortie.ecrire(lot)
+            sortie.fichier.flush()
+            debut = time.perf_counter()
+            nouvelles = suivi.lire_nouveautes()
+            duree = time.perf_counter() - debut
+            print(f"ajout {numero} : fichier {os.path.getsize(chemin) / 1024 ** 2:.0f} Mo, "
+                  f"{nouvelles} lignes ingerees en {duree * 1000:.1f} ms")
+
+    shutil.rmtree(dossier)
+
+
+def _chargement(chemin):
+    # Execute dans un processus neuf : temps de lecture + KPIs, puis pic RSS (Ko sous Linux)
+    import dataset
+    import analytics
+
+    debut = time.perf_counter()
+    donnees = dataset.lire_fichier(chemin)
+    lecture = time.perf_counter() - debut
+    analytics.calculer_kpis(donnees)
+    total = time.perf_counter() - debut
+    return lecture, total, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def bench_binaire(lignes):
+    import dataset
+
+    duree_heures = lignes / MESURES_PAR_HEURE
+    dossier = tempfile.mkdtemp()
+    chemin_csv = os.path.join(dossier, 'mesures_bench.csv')
+    chemin_binaire = os.path.join(dossier, 'mesures_bench.ufmb')
+    data_generator.generer_donnees_ufm160(DEBUT, duree_heures, chemin_csv, graine=42)
+    conversion = chronometrer(lambda: dataset.convertir_csv_binaire(chemin_csv, chemin_binaire))
+    print(f"conversion CSV -> binaire : {conversion:.3f} s")
+
+    contexte = multiprocessing.get_context('spawn')
+    for chemin in (chemin_csv, chemin_binaire):
+        with contexte.Pool(1) as pool:
+            lecture, total, pic_ko = pool.apply(_chargement, (chemin,))
+        print(f"{os.path.basename(chemin)} : {lignes} lignes, fichier "
+              f"{os.path.getsize(chemin) / 1024 ** 2:.0f} Mo, lecture {lecture:.3f} s, "
+              f"lecture + KPIs {total:.3f} s, pic RSS {pic_ko / 1024:.1f} Mo")
+        os.remove(chemin)
+
+    shutil.rmtree(dossier)
+
+
+def bench_catalogue(runs, lignes, liste_workers):
+    import catalogue
+
+    dossier = tempfile.mkdtemp()
+    duree_heures = lignes / MESURES_PAR_HEURE
+    for numero in range(runs):
+        debut = DEBUT + timedelta(days=numero)
+        data_generator.generer_donnees_ufm160(
+            debut, duree_heures, data_generator.chemin_run(debut, f"L{numero % 4}", dossier), graine=numero)
+
+    # Toujours en parallele au-dela d'un worker, pour mesurer le passage a l'echelle seul
+    catalogue.OCTETS_MIN_PARALLELE = 0
+    for workers in liste_workers:
+        for nom in os.listdir(dossier):
+            if nom.endswith(catalogue.SUFFIXE_RESUME):
+                os.remove(os.path.join(dossier, nom))
+        duree = chronometrer(lambda: catalogue.Catalogue(dossier, workers).runs())
+        print(f"{workers} workers : {runs} runs de {lignes} lignes resumes en {duree:.3f} s")
+
+    disque = chronometrer(lambda: catalogue.Catalogue(dossier).runs())
+    resident = catalogue.Catalogue(dossier)
+    resident.runs()
+    memoire = chronometrer(lambda: catalogue.fusionner(resident.runs()).kpis(), 10)
+    print(f"resumes sur disque : {disque * 1000:.1f} ms ; en memoire + fusion : {memoire * 1000:.2f} ms")
+    shutil.rmtree(dossier)
+
+
+def _vider_cache_fichier(chemin):
+    # Retire le fichier du cache de pages (noyau, client NFS) : la lecture suivante va au disque
+    fd = os.open(chemin, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def bench_compression(lignes, dossier, debit, niveaux_gzip, niveaux_zstd):
+    # Octets sur disque contre debit de lecture de bout en bout (decompression, analyse du
+    # CSV et KPIs, qui touchent aussi les pages projetees d'un .ufmb)
+    import dataset
+    import analytics
+
+    duree_heures = lignes / MESURES_PAR_HEURE
+    dossier = tempfile.mkdtemp(dir=dossier)
+    variantes = [('.csv', None)] + [('.csv.gz', niveau) for niveau in niveaux_gzip] \
+        + [('.csv.zst', niveau) for niveau in niveaux_zstd] + [(data_generator.EXTENSION_BINAIRE, None)]
+    taille_csv = None
+    print(f"{lignes} lignes ; estimation sur un lien a {debit:.0f} Mo/s : octets / debit + lecture")
+    for extension, niveau in variantes:
+        chemin = os.path.join(dossier, 'mesures_bench' + extension)
+        ecriture = chronometrer(lambda: data_generator.generer_donnees_ufm160(
+            DEBUT, duree_heures, chemin, graine=42, niveau=niveau))
+        octets = os.path.getsize(chemin)
+        taille_csv = taille_csv or octets
+
+        def lire():
+            _vider_cache_fichier(chemin)
+            analytics.calculer_kpis(dataset.lire_fichier(chemin))
+        lecture = chronometrer(lire, 3)
+        libelle = extension + (f" niveau {niveau}" if niveau is not None else '')
+        print(f"{libelle:<20} : {octets / 1024 ** 2:8.1f} Mo (x{taille_csv / octets:4.1f}), "
+              f"ecriture {ecriture:6.2f} s, lecture {lecture:6.2f} s "
+              f"({lignes / lecture:,.0f} lignes/s), estimation {octets / 1024 ** 2 / debit + lecture:6.2f} s")
+        os.remove(chemin)
+    shutil.rmtree(dossier)
+
+
+def _octets_alloues(fabriquer):
+    # Octets encore alloues (tracemalloc) par l'objet que renvoie fabriquer()
+    import tracemalloc
+
+    tracemalloc.start()
+    avant = tracemalloc.get_traced_memory()[0]
+    objet = fabriquer()
+    octets = tracemalloc.get_traced_memory()[0] - avant
+    tracemalloc.stop()
+    del objet
+    return octets
+
+
+def bench_empreinte(lignes, echantillon):
+    # Memoire par mesure selon la representation : dictionnaires de chaines (csv.DictReader),
+    # colonnes d'un Dataset et tableau structure DTYPE_MESURE. Les dictionnaires sont mesures
+    # sur un echantillon et extrapoles (10M lignes ne tiennent pas en memoire sous cette forme)
+    import io
+    import csv
+    import random
+    import numpy as np
+    import dataset
+
+    lot = next(data_generator.iter_mesures(DEBUT, echantillon / MESURES_PAR_HEURE,
+                                           taille_lot=echantillon, graine=42))
+    texte = ','.join(data_generator.COLONNES) + '\r\n' + data_generator.formater_lot_csv(lot).decode('ascii')
+    par_ligne = {
+        'csv.DictReader (dict de str)': _octets_alloues(
+            lambda: list(csv.DictReader(io.StringIO(texte)))) / echantillon,
+        'Dataset (colonnes NumPy)': _octets_alloues(
+            lambda: dataset.parser_colonnes(io.StringIO(texte))) / echantillon,
+        'DTYPE_MESURE (tableau structure)': data_generator.DTYPE_MESURE.itemsize,
+    }
+    print(f"Par mesure (echantillon de {echantillon} lignes) :")
+    for nom, octets in par_ligne.items():
+        print(f"  {nom:<34} {octets:8.0f} octets -> "
+              f"{octets * lignes / 1024 ** 2:9.0f} Mo pour {lignes} mesures")
+
+    # Mesure reelle pour `lignes` mesures : lots du generateur recopies dans un seul tableau
+    def remplir():
+        enregistrements = np.empty(lignes, dtype=data_generator.DTYPE_MESURE)
+        debut = 0
+        for lot in data_generator.iter_mesures(DEBUT, lignes / MESURES_PAR_HEURE, graine=42):
+            enregistrements[debut:debut + len(lot['pk_position'])] = data_generator.vers_enregistrements(lot)
+            debut += len(lot['pk_position'])
+        return enregistrements
+    print(f"DTYPE_MESURE, {lignes} mesures generees : {_octets_alloues(remplir) / 1024 ** 2:.0f} Mo alloues")
+
+    # Anomalies isolees (generation ligne a ligne) : dictionnaire contre __slots__
+    random.seed(42)
+    anomalies = 100_000
+    dictionnaires = _octets_alloues(lambda: [
+        {'type': anomalie.type.libelle, 'position': anomalie.position, 'gravite': anomalie.gravite.value}
+        for anomalie in (data_generator.generer_anomalie() for _ in range(anomalies))])
+    compactes = _octets_alloues(lambda: [data_generator.generer_anomalie() for _ in range(anomalies)])
+    print(f"Anomalie : dict {dictionnaires / anomalies:.0f} octets, "
+          f"__slots__ {compactes / anomalies:.0f} octets")
+
+
+def bench_detection(lignes, tailles_lot):
+    # Debit du detecteur de depassements seul, sur des lots deja en memoire (generateur ou
+    # lecture de fichier), avec quelques defauts injectes
+    import numpy as np
+    import depassements
+
+    colonnes = next(data_generator.iter_mesures(DEBUT, lignes / MESURES_PAR_HEURE, taille_lot=lignes,
+                                                graine=42))
+    rng = np.random.default_rng(42)
+    for nom in depassements.COLONNES_SURVEILLEES:
+        regle = depassements.REGLES[nom]
+        defauts = rng.integers(0, lignes, max(1, lignes // 100_000))
+        colonnes[nom][defauts] = regle.maximum + (regle.maximum - regle.minimum) / 10
+
+    for taille_lot in tailles_lot:
+        def detecter():
+            detecteur = depassements.DetecteurDepassements()
+            for debut in range(0, lignes, taille_lot):
+                detecteur.ajouter({nom: colonne[debut:debut + taille_lot]
+                                   for nom, colonne in colonnes.items()})
+            return detecteur
+        duree = chronometrer(detecter, 3)
+        print(f"lots de {taille_lot:>9} : {duree:6.3f} s ({lignes / duree:,.0f} lignes/s), "
+              f"{detecter().instantane().total} depassements")
+
+
+def _graphiques_png(dossier, positions, hauteurs, compteur_anomalies):
+    # Ancien rendu de l'onglet Visualisation : figures reconstruites, PNG ecrit puis relu
+    from matplotlib.figure import Figure
+    from PyQt5.QtGui import QPixmap
+
+    fig1 = Figure(figsize=(11, 4.5))
+    ax1 = fig1.subplots()
+    ax1.plot(positions, hauteurs, linewidth=1, color='#2196f3', alpha=0.8)
+    for hauteur in (5.5, 4.0, 7.0):
+        ax1.axhline(y=hauteur, linestyle='--', label=f'{hauteur}m')
+    ax1.fill_between(positions, 4.0, 7.0, alpha=0.05, color='#4caf50')
+    ax1.set_title('Mesures UFM 160')
+    ax1.grid(True, alpha=0.3, linestyle=':')
+    ax1.legend(fontsize=9)
+    fig1.tight_layout()
+    fig1.savefig(os.path.join(dossier, 'graph_hauteurs.png'), dpi=100, bbox_inches='tight')
+
+    fig2 = Figure(figsize=(11, 4.5))
+    ax2 = fig2.subplots()
+    bars = ax2.bar(list(compteur_anomalies), list(compteur_anomalies.values()), edgecolor='#333')
+    ax2.grid(True, alpha=0.3, linestyle=':', axis='y')
+    for bar in bars:
+        ax2.text(bar.get_x() + bar.get_width() / 2., bar.get_height(), f'{int(bar.get_height())}',
+                 ha='center', va='bottom')
+    fig2.tight_layout()
+    fig2.savefig(os.path.join(dossier, 'graph_anomalies.png'), dpi=100, bbox_inches='tight')
+
+    return [QPixmap(os.path.join(dossier, nom)) for nom in ('graph_hauteurs.png', 'graph_anomalies.png')]
+
+
+def bench_graphiques(lignes, repetitions):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    import numpy as np
+    from PyQt5.QtWidgets import QApplication
+    import gui_main
+    from echantillonnage import reduire_min_max
+
+    application = QApplication.instance() or QApplication([])
+    lot = next(data_generator.iter_mesures(DEBUT, lignes / MESURES_PAR_HEURE, taille_lot=lignes, graine=42))
+    positions, hauteurs = reduire_min_max(lot['pk_position'], lot['hauteur_catenaire'])
+    compteur = np.bincount(lot['defaut_type'][lot['defaut_type'] >= 0],
+                           minlength=len(data_generator.TYPES_ANOMALIES))
+    compteur_anomalies = dict(zip(data_generator.TYPES_ANOMALIES, compteur.tolist()))
+
+    dossier = tempfile.mkdtemp()
+    avant = chronometrer(lambda: _graphiques_png(dossier, positions, hauteurs, compteur_anomalies),
+                         repetitions)
+    shutil.rmtree(dossier)
+
+    graphiques = gui_main.GraphiquesMesures()
+
+    def rafraichir():
+        graphiques.mettre_a_jour(positions, hauteurs, compteur_anomalies)
+        graphiques.dessiner()
+
+    rafraichir()
+    apres = chronometrer(rafraichir, repetitions)
+    print(f"{len(positions)} points affiches ({lignes} mesures) : PNG sur disque {avant * 1000:.0f} ms, "
+          f"canevas integre {apres * 1000:.0f} ms (x{avant / apres:.1f})")
+    application.processEvents()
+
+
+# Ecart absolu en dessous duquel une degradation est attribuee au bruit de mesure
+PLANCHER_REGRESSION = 0.001  # secondes
+PLANCHER_REGRESSION_RSS = 5.0  # Mo
+ROUTES_SUITE = ('/stats', '/anomalies', '/hauteurs', '/hauteurs/series', '/segments',
+                '/range?pk_min=1000&pk_max=2000')
+
+
+def _mesurer_pipeline(lignes, repetitions):
+    # Execute dans un processus neuf : chaque taille part d'un cache vide et d'un pic RSS propre
+    import numpy as np
+    import dataset
+    import analytics
+    from echantillonnage import reduire_min_max
+
+    dossier = tempfile.mkdtemp()
+    chemin = os.path.join(dossier, 'mesures_bench.csv')
+    dataset.CHEMIN_MESURES = chemin
+    temps = {}
+    try:
+        temps['generation'] = chronometrer(lambda: data_generator.generer_donnees_ufm160(
+            DEBUT, lignes / MESURES_PAR_HEURE, chemin, graine=42), 1)
+        temps['lecture_csv'] = chronometrer(lambda: dataset.lire_csv(chemin), 1)
+        donnees = dataset.charger_dataset()
+        temps['kpis'] = chronometrer(lambda: analytics.calculer_kpis(donnees), repetitions)
+        temps['preparation_graphique'] = chronometrer(lambda: reduire_min_max(
+            donnees['pk_position'], donnees['hauteur_catenaire']), repetitions)
+
+        import api
+        client = api.app.test_client()
+        # Premier appel : ingestion complete du fichier par le thread de rafraichissement
+        temps['api_premier_appel'] = chronometrer(lambda: client.get('/stats'), 1)
+        for route in ROUTES_SUITE:
+            reponse = client.get(route)
+            if reponse.status_code != 200:
+                raise RuntimeError(f"{route} : HTTP {reponse.status_code}")
+            temps['api ' + route] = chronometrer(lambda: client.get(route), repetitions)
+        api.rafraichisseur.arreter()
+    finally:
+        shutil.rmtree(dossier)
+
+    temps['pic_rss_mo'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return temps
+
+
+# Demarrages a froid, chacun dans un interpreteur neuf (cache d'import vide) : garde-fou
+# contre les imports lourds ajoutes au chargement des modules
+DEMARRAGES = {
+    'import api': "import api",
+    'api premiere reponse': "import api\napi.app.test_client().get('/health')",
+    'import gui_main': "import gui_main",
+    'gui premier affichage': "import sys\nfrom PyQt5.QtWidgets import QApplication\n"
+                             "application = QApplication(sys.argv)\nimport gui_main\n"
+                             "fenetre = gui_main.RailCheckApp()\nfenetre.show()\napplication.processEvents()",
+}
+
+
+def _mesurer_demarrage(repetitions):
+    # Secondes depuis le lancement du script jusqu'a sa derniere instruction (meilleur temps) ;
+    # un demarrage impossible ici (PyQt5 absent, pas d'affichage) est ignore
+    environnement = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    dossier = os.path.dirname(os.path.abspath(__file__))
+    temps = {}
+    for nom, script in DEMARRAGES.items():
+        programme = f"import time\ndebut = time.perf_counter()\n{script}\nprint(time.perf_counter() - debut)"
+        mesures = []
+        for _ in range(repetitions):
+            resultat = subprocess.run([sys.executable, '-c', programme], cwd=dossier, env=environnement,
+                                      capture_output=True, text=True)
+            if resultat.returncode != 0:
+                print(f"{nom} : indisponible ({resultat.stderr.strip().splitlines()[-1:]})", file=sys.stderr)
+                break
+            mesures.append(float(resultat.stdout.strip().splitlines()[-1]))
+        else:
+            temps[nom] = min(mesures)
+    return temps
+
+
+def bench_demarrage(repetitions, detail):
+    for nom, duree in _mesurer_demarrage(repetitions).items():
+        print(f"{nom:<24} : {duree * 1000:7.1f} ms")
+    if not detail:
+        return
+    # Modules les plus couteux a l'import (temps cumule, sous-modules compris)
+    dossier = os.path.dirname(os.path.abspath(__file__))
+    for module in ('api', 'gui_main'):
+        resultat = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=dossier,
+                                  capture_output=True, text=True)
+        lignes = [ligne.split('|') for ligne in resultat.stderr.splitlines()
+                  if ligne.startswith('import time:') and 'cumulative' not in ligne]
+        lignes.sort(key=lambda champs: int(champs[1]), reverse=True)
+        print(f"\nimport {module} : modules les plus lents (cumule)")
+        for _, cumule, nom_module in lignes[:detail]:
+            print(f"  {int(cumule) / 1000:8.1f} ms  {nom_module.strip()}")
+
+
+def comparer_resultats(resultats, reference, seuil):
+    # Renvoie les mesures degradees de plus de `seuil` (0.2 = +20 %) par rapport a la reference
+    regressions = []
+    for taille, mesures in resultats.items():
+        for nom, valeur in mesures.items():
+            ancienne = reference.get(taille, {}).get(nom)
+            plancher = PLANCHER_REGRESSION_RSS if nom == 'pic_rss_mo' else PLANCHER_REGRESSION
+            if ancienne and valeur > ancienne * (1 + seuil) and valeur - ancienne > plancher:
+                regressions.append((taille, nom, ancienne, valeur))
+    return regressions
+
+
+def bench_suite(tailles, repetitions, sortie, reference, seuil):
+    import numpy as np
+
+    contexte = multiprocessing.get_context('spawn')
+    resultats = {}
+    for lignes in tailles:
+        with contexte.Pool(1) as pool:
+            resultats[str(lignes)] = pool.apply(_mesurer_pipeline, (lignes, repetitions))
+        for nom, valeur in resultats[str(lignes)].items():
+            unite = 'Mo' if nom == 'pic_rss_mo' else 'ms'
+            print(f"{lignes} lignes | {nom:<36} {valeur if unite == 'Mo' else valeur * 1000:10.2f} {unite}")
+    resultats['demarrage'] = _mesurer_demarrage(repetitions)
+    for nom, valeur in resultats['demarrage'].items():
+        print(f"demarrage | {nom:<36} {valeur * 1000:10.2f} ms")
+
+    rapport = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu': os.cpu_count(),
+        'repetitions': repetitions,
+        'resultats': resultats,
+    }
+    if sortie:
+        with open(sortie, 'w', encoding='utf-8') as fichier:
+            json.dump(rapport, fichier, indent=2)
+        print(f"Resultats ecrits dans {sortie}")
+
+    if reference:
+        with open(reference, encoding='utf-8') as fichier:
+            regressions = comparer_resultats(resultats, json.load(fichier)['resultats'], seuil)
+        for taille, nom, ancienne, valeur in regressions:
+            print(f"REGRESSION {taille} lignes | {nom} : {ancienne:.4g} -> {valeur:.4g} "
+                  f"(+{valeur / ancienne - 1:.0%}, seuil {seuil:.0%})")
+        if regressions:
+            sys.exit(1)
+        print(f"Aucune regression au-dela de {seuil:.0%}")
+
+
+def _client_charge(url, routes, debut, fin):
+    # Un client HTTP (connexion keep-alive) qui enchaine les requetes entre debut et fin
+    import http.client
+    from urllib.parse import urlsplit
+
+    cible = urlsplit(url)
+    connexion = http.client.HTTPConnection(cible.hostname, cible.port or 80, timeout=30)
+    latences, erreurs, numero = [], 0, 0
+    time.sleep(max(debut - time.time(), 0))
+    while time.time() < fin:
+        route = routes[numero % len(routes)]
+        numero += 1
+        depart = time.perf_counter()
+        try:
+            connexion.request('GET', route)
+            reponse = connexion.getresponse()
+            reponse.read()
+            if reponse.status != 200:
+                erreurs += 1
+                continue
+        except (OSError, http.client.HTTPException):
+            erreurs += 1
+            connexion.close()
+            continue
+        latences.append(time.perf_counter() - depart)
+    connexion.close()
+    return latences, erreurs
+
+
+def attendre_pret(url, delai=120):
+    from urllib.request import urlopen
+    from urllib.error import URLError
+
+    limite = time.time() + delai
+    while time.time() < limite:
+        try:
+            with urlopen(url + '/ready', timeout=5) as reponse:
+                if reponse.status == 200:
+                    return
+        except (URLError, OSError):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} n'est pas pret apres {delai} s")
+
+
+def bench_charge(url, routes, concurrences, duree):
+    import numpy as np
+
+    url = url.rstrip('/')
+    attendre_pret(url)
+    contexte = multiprocessing.get_context('spawn')
+    for clients in concurrences:
+        # Un processus par client : le client n'est pas limite par le GIL
+        with contexte.Pool(clients) as pool:
+            debut = time.time() + 1.0
+            resultats = pool.starmap(_client_charge, [(url, routes, debut, debut + duree)] * clients)
+        latences = np.concatenate([np.asarray(r[0]) for r in resultats]) * 1000
+        erreurs = sum(r[1] for r in resultats)
+        p50, p95, p99 = np.percentile(latences, [50, 95, 99]) if len(latences) else (0, 0, 0)
+        print(f"{clients:3d} clients : {len(latences) / duree:8,.0f} req/s, latence p50 {p50:.1f} ms, "
+              f"p95 {p95:.1f} ms, p99 {p99:.1f} ms, erreurs {erreurs}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks RailCheck Mini")
+    sous_commandes = parser.add_subparsers(dest='commande', required=True)
+
+    generation = sous_commandes.add_parser('generation', help="Temps de generation CSV")
+    generation.add_argument('--lignes', type=int, default=1_000_000)
+    generation.add_argument('--repetitions', type=int, default=3)
+    generation.add_argument('--comparer', action='store_true',
+                            help="Mesurer aussi le generateur ligne a ligne")
+
+    memoire = sous_commandes.add_parser('memoire', help="Pic memoire de la generation en flux")
+    memoire.add_argument('--durees', type=float, nargs='+', default=[1, 72],
+                         help="Durees simulees en heures")
+
+    parallele = sous_commandes.add_parser('parallele', help="Passage a l'echelle multi-processus")
+    parallele.add_argument('--lignes', type=int, default=10_000_000)
+    parallele.add_argument('--workers', type=int, nargs='+',
+                           default=[n for n in (1, 2, 4, 8, 16) if n <= (os.cpu_count() or 1)])
+
+    api = sous_commandes.add_parser('api', help="Latence des endpoints Flask")
+    api.add_argument('--lignes', type=int, default=1_000_000)
+    api.add_argument('--repetitions', type=int, default=20)
+
+    suivi = sous_commandes.add_parser('suivi', help="Cout de l'ingestion incrementale")
+    suivi.add_argument('--lots', type=int, default=10)
+    suivi.add_argument('--taille-lot', type=int, default=36000)
+
+    binaire = sous_commandes.add_parser('binaire', help="Chargement CSV contre binaire .ufmb")
+    binaire.add_argument('--lignes', type=int, default=10_000_000)
+
+    graphiques = sous_commandes.add_parser('graphiques', help="Temps de rafraichissement des graphiques")
+    graphiques.add_argument('--lignes', type=int, default=1_000_000)
+    graphiques.add_argument('--repetitions', type=int, default=5)
+
+    suite = sous_commandes.add_parser('suite', help="Pipeline complet, resultats JSON et detection "
+                                                    "des regressions")
+    suite.add_argument('--tailles', type=int, nargs='+', default=[10_000, 1_000_000, 10_000_000])
+    suite.add_argument('--repetitions', type=int, default=5)
+    suite.add_argument('--sortie', help="Fichier JSON ou ecrire les resultats")
+    suite.add_argument('--reference', help="Resultats JSON d'un passage precedent a comparer")
+    suite.add_argument('--seuil', type=float, default=0.2,
+                       help="Degradation toleree par rapport a la reference (0.2 = +20 %%)")
+
+    demarrage = sous_commandes.add_parser('demarrage', help="Demarrage a froid de l'API et de l'interface")
+    demarrage.add_argument('--repetitions', type=int, default=5)
+    demarrage.add_argument('--detail', type=int, nargs='?', const=15, default=0,
+                           help="Afficher les N imports les plus lents (python -X importtime)")
+
+    charge = sous_commandes.add_parser('charge', help="Test de charge HTTP d'un serveur demarre "
+                                                      "(requetes/s selon la concurrence)")
+    charge.add_argument('--url', default='http://127.0.0.1:5000')
+    charge.add_argument('--routes', nargs='+', default=['/stats', '/anomalies', '/hauteurs'])
+    charge.add_argument('--concurrences', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    charge.add_argument('--duree', type=float, default=10, help="Secondes par niveau de concurrence")
+
+    compression = sous_commandes.add_parser('compression', help="Taille sur disque et debit de lecture "
+                                                               "des CSV compresses")
+    compression.add_argument('--lignes', type=int, default=1_000_000)
+    compression.add_argument('--dossier', help="Dossier des fichiers de test (par exemple un montage NFS)")
+    compression.add_argument('--debit', type=float, default=100, help="Debit du stockage en Mo/s pour l'estimation")
+    compression.add_argument('--gzip', type=int, nargs='*', default=[1, 6, 9], help="Niveaux gzip")
+    compression.add_argument('--zstd', type=int, nargs='*', default=[1, 3, 9], help="Niveaux zstd")
+
+    empreinte = sous_commandes.add_parser('empreinte', help="Memoire par mesure selon la representation")
+    empreinte.add_argument('--lignes', type=int, default=10_000_000)
+    empreinte.add_argument('--echantillon', type=int, default=100_000,
+                           help="Lignes mesurees pour les representations extrapolees")
+
+    detection = sous_commandes.add_parser('detection', help="Debit du detecteur de depassements")
+    detection.add_argument('--lignes', type=int, default=5_000_000)
+    detection.add_argument('--tailles-lot', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+
+    runs = sous_commandes.add_parser('catalogue', help="Resume et agregation d'un catalogue de runs")
+    runs.add_argument('--runs', type=int, default=100)
+    runs.add_argument('--lignes', type=int, default=36000, help="Mesures par run")
+    runs.add_argument('--workers', type=int, nargs='+',
+                      default=[n for n in (1, 2, 4, 8, 16) if n <= (os.cpu_count() or 1)])
+
+    args = parser.parse_args()
+    if args.commande == 'generation':
+        bench_generation(args.lignes, args.repetitions, args.comparer)
+    elif args.commande == 'memoire':
+        bench_memoire(args.durees)
+    elif args.commande == 'parallele':
+        bench_parallele(args.lignes, args.workers)
+    elif args.commande == 'api':
+        bench_api(args.lignes, args.repetitions)
+    elif args.commande == 'suivi':
+        bench_suivi(args.lots, args.taille_lot)
+    elif args.commande == 'binaire':
+        bench_binaire(args.lignes)
+    elif args.commande == 'graphiques':
+        bench_graphiques(args.lignes, args.repetitions)
+    elif args.commande == 'demarrage':
+        bench_demarrage(args.repetitions, args.detail)
+    elif args.commande == 'suite':
+        bench_suite(args.tailles, args.repetitions, args.sortie, args.reference, args.seuil)
+    elif args.commande == 'charge':
+        bench_charge(args.url, args.routes, args.concurrences, args.duree)
+    elif args.commande == 'compression':
+        bench_compression(args.lignes, args.dossier, args.debit, args.gzip, args.zstd)
+    elif args.commande == 'catalogue':
+        bench_catalogue(args.runs, args.lignes, args.workers)
+    elif args.commande == 'empreinte':
+        bench_empreinte(args.lignes, args.echantillon)
+    elif args.commande == 'detection':
+        bench_detection(args.lignes, args.tailles_lot)
@@ -0,0 +1,127 @@
+import os
+import gzip
+import json
+import zlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from flask import Response, request
+
+from metriques import CACHE_REPONSES
+
+ENTREES_MAX = 128  # corps JSON gardes en memoire (les moins recemment servis sont oublies)
+COMPRESSION = os.environ.get('RAILCHECK_GZIP', '1') not in ('', '0')
+TAILLE_MIN_COMPRESSION = 1024  # octets : en dessous, gzip ne fait rien gagner
+NIVEAU_COMPRESSION = 6
+SUFFIXE_GZIP = '-gz'
+
+
+class CorpsJson:
+    # Corps serialise une fois pour une version des donnees ; la variante gzip n'est
+    # calculee qu'a la premiere demande
+    def __init__(self, version: str, brut: bytes):
+        self.version = version
+        self.brut = brut
+        self._compresse: Optional[bytes] = None
+
+    def compresse(self) -> bytes:
+        if self._compresse is None:
+            self._compresse = gzip.compress(self.brut, NIVEAU_COMPRESSION, mtime=0)
+        return self._compresse
+
+
+class CacheReponses:
+    # Reponses JSON des routes en lecture seule, memoisees par (route + parametres, version des
+    # donnees). L'ETag ne depend que de la version et de la cle : un client qui renvoie l'ETag
+    # recu recoit un 304 sans que le corps soit recalcule, quel que soit le worker interroge.
+    def __init__(self, entrees_max: int = ENTREES_MAX):
+        self.entrees_max = entrees_max
+        self.entrees: 'OrderedDict[str, CorpsJson]' = OrderedDict()
+        self.verrou = threading.Lock()
+
+    @staticmethod
+    def etag(cle: str, version: str) -> str:
+        return f"{version}-{zlib.crc32(cle.encode('utf-8')):08x}"
+
+    def corps(self, cle: str, version: str, fabriquer: Callable[[], Any]) -> CorpsJson:
+        with self.verrou:
+            corps = self.entrees.get(cle)
+            if corps is not None and corps.version == version:
+                self.entrees.move_to_end(cle)
+                CACHE_REPONSES.labels('memoire').inc()
+                return corps
+        # Calcul hors verrou : deux requetes simultanees peuvent le faire en double, sans
+        # bloquer les autres routes
+        CACHE_REPONSES.labels('calcul').inc()
+        brut = json.dumps(fabriquer(), separators=(',', ':')).encode('utf-8')
+        corps = CorpsJson(version, brut)
+        with self.verrou:
+            self.entrees[cle] = corps
+            self.entrees.move_to_end(cle)
+            while len(self.entrees) > self.entrees_max:
+                self.entrees.popitem(last=False)
+        return corps
+
+    def servir(self, version: str, modification: Optional[float],
+               fabriquer: Callable[[], Any]) -> Response:
+        # Reponse a la requete courante : 304 si le client a deja cette version, sinon le
+        # corps memoise (compresse si le client accepte gzip)
+        cle = request.full_path
+        etag = self.etag(cle, version)
+        if _inchange(etag, modification):
+            CACHE_REPONSES.labels('inchange').inc()
+            reponse = Response(status=304)
+        else:
+            corps = self.corps(cle, version, fabriquer)
+            if COMPRESSION and len(corps.brut) >= TAILLE_MIN_COMPRESSION \
+                    and 'gzip' in request.accept_encodings:
+                reponse = Response(corps.compresse(), mimetype='application/json')
+                reponse.content_encoding = 'gzip'
+                # Representation differente, ETag different
+                etag += SUFFIXE_GZIP
+            else:
+                reponse = Response(corps.brut, mimetype='application/json')
+        return _entetes(reponse, etag, modification)
+
+    def servir_flux(self, version: str, modification: Optional[float],
+                    fabriquer: Callable[[], Tuple[Iterable[str], Dict[str, str]]],
+                    mimetype: str = 'application/json') -> Response:
+        # Comme servir, pour un corps envoye morceau par morceau au fil de sa serialisation :
+        # fabriquer() renvoie (morceaux, en-tetes). Pas de memoisation ni de gzip (le corps
+        # n'existe jamais en entier), mais le meme ETag / 304
+        etag = self.etag(request.full_path, version)
+        if _inchange(etag, modification):
+            CACHE_REPONSES.labels('inchange').inc()
+            reponse = Response(status=304)
+        else:
+            CACHE_REPONSES.labels('calcul').inc()
+            morceaux, entetes = fabriquer()
+            reponse = Response(morceaux, mimetype=mimetype, headers=entetes)
+        return _entetes(reponse, etag, modification)
+
+    def vider(self) -> None:
+        with self.verrou:
+            self.entrees.clear()
+
+
+def _entetes(reponse: Response, etag: str, modification: Optional[float]) -> Response:
+    reponse.set_etag(etag)
+    if modification is not None:
+        reponse.last_modified = modification
+    # Le client revalide a chaque fois : un 304 ne coute qu'une comparaison d'ETag
+    reponse.cache_control.no_cache = True
+    reponse.vary.add('Accept-Encoding')
+    return reponse
+
+
+def _inchange(etag: str, modification: Optional[float]) -> bool:
+    # If-None-Match prime sur If-Modified-Since (RFC 9110, 13.1.3). Comparaison faible (les
+    # proxys qui compressent affaiblissent les ETag) ; les deux encodages d'une meme version
+    # ont le meme contenu
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag) \
+            or request.if_none_match.contains_weak(etag + SUFFIXE_GZIP)
+    if modification is not None and request.if_modified_since is not None:
+        return int(modification) <= request.if_modified_since.timestamp()
+    return False
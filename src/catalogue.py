@@ -0,0 +1,257 @@
+import os
+import re
+import sys
+import json
+import zlib
+import fcntl
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import data_generator
+from analytics import AgregatsCourants, Kpis
+from dataset import lire_fichier, version_fichier
+
+DOSSIER_RUNS = os.environ.get('RAILCHECK_DOSSIER_RUNS', data_generator.DOSSIER_RUNS)
+SUFFIXE_RESUME = '.resume.json'  # resume d'un run, enregistre a cote du fichier de mesures
+FICHIER_VERROU = '.catalogue.verrou'  # serialise le calcul des resumes entre processus
+EXTENSIONS_RUNS = ('.csv', '.csv.gz', '.csv.zst', data_generator.EXTENSION_BINAIRE)
+OCTETS_MIN_PARALLELE = 64 << 20  # en dessous, demarrer des processus coute plus que la lecture
+MOTIF_RUN = re.compile(r'^mesures_(?P<ligne>.+)_(?P<date>\d{8}-\d{6})$')  # data_generator.chemin_run
+
+
+@dataclass
+class ResumeRun:
+    # Agregats d'un fichier de mesures et de quoi le selectionner sans le relire
+    chemin: str
+    version: Tuple[int, int]
+    ligne: Optional[str]
+    debut: Optional[str]  # premier et dernier horodatage (ISO 8601), None si le run est vide
+    fin: Optional[str]
+    agregats: AgregatsCourants
+
+    @property
+    def nom(self) -> str:
+        return os.path.basename(self.chemin)
+
+    def kpis(self) -> Kpis:
+        return self.agregats.kpis()
+
+    def etat(self) -> Dict[str, Any]:
+        return {'version': list(self.version), 'ligne': self.ligne, 'debut': self.debut,
+                'fin': self.fin, 'agregats': self.agregats.etat()}
+
+    @classmethod
+    def depuis_etat(cls, chemin: str, etat: Dict[str, Any]) -> 'ResumeRun':
+        return cls(chemin, tuple(etat['version']), etat['ligne'], etat['debut'], etat['fin'],
+                   AgregatsCourants.depuis_etat(etat['agregats']))
+
+
+def est_run(nom: str) -> bool:
+    # Fichiers de mesures seulement : ni copies .cache.ufmb, ni tranches .partNNNN, ni
+    # fichiers temporaires (leur nom contient un point de plus ou commence par un point)
+    racine, extension = data_generator.decouper_extension(nom)
+    return extension in EXTENSIONS_RUNS and '.' not in racine and not nom.startswith('.')
+
+
+def lister_runs(dossier: str = DOSSIER_RUNS) -> List[str]:
+    # Chemins des runs du dossier, du plus recent au plus ancien (date de modification)
+    try:
+        entrees = [entree for entree in os.scandir(dossier) if entree.is_file() and est_run(entree.name)]
+    except FileNotFoundError:
+        return []
+    entrees.sort(key=lambda entree: entree.stat().st_mtime, reverse=True)
+    return [entree.path for entree in entrees]
+
+
+def ligne_run(chemin: str) -> Optional[str]:
+    correspondance = MOTIF_RUN.match(data_generator.decouper_extension(os.path.basename(chemin))[0])
+    return correspondance.group('ligne') if correspondance else None
+
+
+def resumer_run(chemin: str) -> Optional[Dict[str, Any]]:
+    # Execute dans un processus du pool : lit le fichier une fois, enregistre le resume
+    # a cote de lui et le renvoie sous forme serialisable. None si le fichier est illisible
+    # (en cours d'ecriture, tronque) : il sera retente au prochain passage
+    try:
+        version = version_fichier(chemin)
+        dataset = lire_fichier(chemin)
+    except (OSError, ValueError):
+        return None
+    agregats = AgregatsCourants()
+    agregats.ajouter(dataset.colonnes, dataset.types_anomalies)
+    debut = fin = None
+    if len(dataset):
+        timestamps = dataset['timestamp']
+        debut, fin = (str(np.datetime_as_string(valeur, unit='s'))
+                      for valeur in (timestamps.min(), timestamps.max()))
+    etat = ResumeRun(chemin, version, ligne_run(chemin), debut, fin, agregats).etat()
+
+    temporaire = f"{chemin}{SUFFIXE_RESUME}.{os.getpid()}.tmp"
+    try:
+        with open(temporaire, 'w', encoding='utf-8') as fichier:
+            json.dump(etat, fichier)
+        os.replace(temporaire, chemin + SUFFIXE_RESUME)
+    except OSError:
+        # Dossier en lecture seule : le resume sera recalcule au prochain demarrage
+        pass
+    return etat
+
+
+def lire_resume(chemin: str, version: Tuple[int, int]) -> Optional[ResumeRun]:
+    try:
+        with open(chemin + SUFFIXE_RESUME, encoding='utf-8') as fichier:
+            etat = json.load(fichier)
+    except (OSError, ValueError):
+        return None
+    if tuple(etat.get('version', ())) != version:
+        return None
+    try:
+        return ResumeRun.depuis_etat(chemin, etat)
+    except KeyError:
+        # Resume d'une version precedente : recalcule
+        return None
+
+
+def _date(valeur: Optional[str]) -> Optional[np.datetime64]:
+    # '2024-01-15' ou '2024-01-15T08:00:00' ; ValueError si la date est illisible
+    return None if valeur is None else np.datetime64(valeur, 's')
+
+
+def selectionner(resumes: List[ResumeRun], debut: Optional[str] = None, fin: Optional[str] = None,
+                 ligne: Optional[str] = None) -> List[ResumeRun]:
+    # Runs de la ligne dont la periode recoupe [debut, fin] (bornes incluses, jour entier
+    # pour une borne de fin sans heure)
+    borne_debut = _date(debut)
+    borne_fin = _date(fin)
+    if fin is not None and 'T' not in fin:
+        borne_fin = np.datetime64(fin, 'D') + np.timedelta64(1, 'D') - np.timedelta64(1, 's')
+    selection = []
+    for resume in resumes:
+        if ligne is not None and resume.ligne != ligne:
+            continue
+        if resume.debut is None:
+            if borne_debut is None and borne_fin is None:
+                selection.append(resume)
+            continue
+        if borne_debut is not None and _date(resume.fin) < borne_debut:
+            continue
+        if borne_fin is not None and _date(resume.debut) > borne_fin:
+            continue
+        selection.append(resume)
+    return selection
+
+
+def fusionner(resumes: List[ResumeRun]) -> AgregatsCourants:
+    total = AgregatsCourants()
+    for resume in resumes:
+        total.fusionner(resume.agregats)
+    return total
+
+
+def version_selection(resumes: List[ResumeRun]) -> str:
+    # Change des qu'un run est ajoute, retire ou modifie
+    empreinte = ';'.join(f"{resume.nom}:{resume.version[0]}:{resume.version[1]}" for resume in resumes)
+    return f"{len(resumes):x}-{zlib.crc32(empreinte.encode('utf-8')):08x}"
+
+
+class Catalogue:
+    # Resumes des runs d'un dossier. Un resume est lu sur disque (<run>.resume.json) tant que
+    # le fichier n'a pas change ; les runs nouveaux ou modifies sont resumes en parallele,
+    # un fichier par processus, et seuls leurs agregats partiels reviennent au processus
+    # principal.
+    def __init__(self, dossier: str = DOSSIER_RUNS, workers: Optional[int] = None):
+        self.dossier = dossier
+        self.workers = workers or os.cpu_count() or 1
+        self.resumes: Dict[str, ResumeRun] = {}
+        self.verrou = threading.Lock()
+
+    def runs(self) -> List[ResumeRun]:
+        with self.verrou:
+            a_jour = {}
+            a_calculer = []
+            octets = 0
+            for chemin in lister_runs(self.dossier):
+                try:
+                    version = version_fichier(chemin)
+                except FileNotFoundError:
+                    continue
+                resume = self.resumes.get(chemin)
+                if resume is None or resume.version != version:
+                    resume = lire_resume(chemin, version)
+                if resume is None:
+                    a_calculer.append(chemin)
+                    octets += version[1]
+                else:
+                    a_jour[chemin] = resume
+            if a_calculer:
+                a_jour.update(self._resumer_seul(a_calculer, octets))
+            self.resumes = a_jour
+            return sorted(a_jour.values(), key=lambda resume: (resume.debut or '', resume.nom))
+
+    def _resumer_seul(self, chemins: List[str], octets: int) -> Dict[str, ResumeRun]:
+        # Un seul processus (worker gunicorn) resume le dossier a la fois : les autres attendent
+        # le verrou puis relisent les resumes qu'il vient d'ecrire au lieu de relancer un pool
+        try:
+            verrou = open(os.path.join(self.dossier, FICHIER_VERROU), 'w')
+        except OSError:
+            # Dossier en lecture seule : aucun resume ne sera ecrit, pas de concurrence a eviter
+            verrou = None
+        try:
+            if verrou is not None:
+                fcntl.flock(verrou, fcntl.LOCK_EX)
+            resumes = {}
+            restants = []
+            for chemin in chemins:
+                try:
+                    resume = lire_resume(chemin, version_fichier(chemin))
+                except FileNotFoundError:
+                    continue
+                if resume is None:
+                    restants.append(chemin)
+                else:
+                    resumes[chemin] = resume
+                    octets -= resume.version[1]
+            for chemin, etat in zip(restants, self._resumer(restants, octets)):
+                if etat is not None:
+                    resumes[chemin] = ResumeRun.depuis_etat(chemin, etat)
+            return resumes
+        finally:
+            if verrou is not None:
+                verrou.close()
+
+    def _resumer(self, chemins: List[str], octets: int) -> List[Optional[Dict[str, Any]]]:
+        if len(chemins) <= 1 or self.workers == 1 or octets < OCTETS_MIN_PARALLELE:
+            return [resumer_run(chemin) for chemin in chemins]
+        # Importes ici : l'interface et les workers de l'API qui ne resument rien ne les chargent pas
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # spawn : le processus appelant peut avoir des threads (API), fork les copierait
+        # dans un etat incoherent
+        contexte = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(chemins)),
+                                 mp_context=contexte) as executor:
+            return list(executor.map(resumer_run, chemins))
+
+    def chemin(self, nom: str) -> str:
+        # Chemin d'un run d'apres son nom de fichier ; KeyError s'il n'est pas au catalogue
+        chemin = os.path.join(self.dossier, os.path.basename(nom))
+        if not est_run(os.path.basename(nom)) or not os.path.isfile(chemin):
+            raise KeyError(nom)
+        return chemin
+
+
+if __name__ == '__main__':
+    # python src/catalogue.py [ligne]
+    catalogue = Catalogue()
+    resumes = selectionner(catalogue.runs(), ligne=sys.argv[1] if len(sys.argv) > 1 else None)
+    for resume in resumes:
+        kpis = resume.kpis()
+        print(f"{resume.nom} : ligne {resume.ligne or '-'}, {resume.debut} -> {resume.fin}, "
+              f"{kpis.total_mesures} mesures, {kpis.anomalies} anomalies")
+    kpis = fusionner(resumes).kpis()
+    print(f"{len(resumes)} runs : {kpis.total_mesures} mesures, {kpis.anomalies} anomalies, "
+          f"conformite {kpis.conformite:.2f}%")
@@ -1,13 +1,68 @@
+import io
 import os
 import csv
+import gzip
+import json
+import uuid
 import random
+import shutil
+import struct
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from enum import Enum, IntEnum
+from functools import lru_cache
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
 
 VITESSE_TRAIN = 140  # km/h
 INTERVALLE_MESURE = 0.1  # secondes
 LONGUEUR_SEGMENT = 100  # mètres
 TAUX_ANOMALIES = 0.04  # 4% d'anomalies
+TAILLE_LOT = 65536  # mesures par lot en mode vectorise
+DOSSIER_RUNS = "data/raw"  # un fichier par passage du train de mesure (run)
+
+class Gravite(Enum):
+    MOYEN = "moyen"
+    ELEVE = "élevé"
+    CRITIQUE = "critique"
+
+class TypeAnomalie(IntEnum):
+    # La valeur est le code stocke dans la colonne defaut_type (int8, -1 sans anomalie) : un
+    # octet par mesure, le libelle et la gravite ne sont crees qu'une fois, avec l'enumeration
+    BOULON_MANQUANT = 0
+    SIGNALISATION_DEFAILLANTE = 1
+    RAIL_FISSURE = 2
+
+    @property
+    def libelle(self) -> str:
+        return self.name.lower()
+
+    @property
+    def gravite(self) -> Gravite:
+        return GRAVITES_TYPES[self]
+
+GRAVITES_TYPES = {
+    TypeAnomalie.BOULON_MANQUANT: Gravite.MOYEN,
+    TypeAnomalie.SIGNALISATION_DEFAILLANTE: Gravite.CRITIQUE,
+    TypeAnomalie.RAIL_FISSURE: Gravite.ELEVE,
+}
+# Libelles (colonne defaut_type des CSV, reponses de l'API), dans l'ordre des codes
+TYPES_ANOMALIES = [type_anomalie.libelle for type_anomalie in TypeAnomalie]
+TYPES_PAR_LIBELLE = {type_anomalie.libelle: type_anomalie for type_anomalie in TypeAnomalie}
+GRAVITE_INCONNUE = 'inconnue'
+
+def gravite_libelle(libelle: str) -> str:
+    # Gravite d'un type lu dans un fichier, qui peut en declarer d'autres que l'enumeration
+    type_anomalie = TYPES_PAR_LIBELLE.get(libelle)
+    return GRAVITE_INCONNUE if type_anomalie is None else type_anomalie.gravite.value
+
+COLONNES = ['timestamp', 'pk_position', 'vitesse', 'hauteur_catenaire',
+            'deport_catenaire', 'ecartement_voie', 'defaut_type', 'defaut_position']
+
+def chemin_run(debut: datetime, ligne: str, dossier: str = DOSSIER_RUNS, extension: str = '.csv') -> str:
+    # Nom d'un run, lu par le catalogue : mesures_<ligne>_<AAAAMMJJ-HHMMSS><extension>
+    return os.path.join(dossier, f"mesures_{ligne}_{debut:%Y%m%d-%H%M%S}{extension}")
 
 def generer_timestamps(debut: datetime, duree_heures: float) -> List[datetime]:
     intervalle=INTERVALLE_MESURE
@@ -41,30 +96,506 @@ def generer_hauteur_catenaire(position: float) -> float:
     
     return hauteur
 
-def generer_anomalie() -> Dict[str, Any]:
+class Anomalie:
+    # Anomalie isolee (generation ligne a ligne) : deux attributs sans dictionnaire d'instance,
+    # la gravite se deduit du type
+    __slots__ = ('type', 'position')
+
+    def __init__(self, type_anomalie: TypeAnomalie, position: float):
+        self.type = type_anomalie
+        self.position = position
+
+    @property
+    def gravite(self) -> Gravite:
+        return self.type.gravite
 
-    types = ["boulon_manquant", "signalisation_defaillante", "rail_fissure"]
-    type_choisi = random.choice(types)
+def generer_anomalie() -> Anomalie:
+
+    type_choisi = random.choice(list(TypeAnomalie))
     
     position = random.uniform(0, 100)
     
-    if type_choisi == "boulon_manquant":
-        gravite = "moyen"
-    elif type_choisi == "signalisation_defaillante":
-        gravite = "critique"
-    else:  
-        gravite = "élevé"
-    
-    anomalie = {
-        "type": type_choisi,
-        "position": round(position, 3),
-        "gravite": gravite
+    return Anomalie(type_choisi, round(position, 3))
+
+def generer_lot(debut: datetime, indice_depart: int, nombre: int,
+                rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    # Genere un lot de mesures sous forme de colonnes NumPy (mode vectorise)
+    indices = np.arange(indice_depart, indice_depart + nombre, dtype=np.int64)
+    ecart_us = indices * int(round(INTERVALLE_MESURE * 1_000_000))
+    timestamps = np.datetime64(debut, 'us') + ecart_us.astype('m8[us]')
+    pk = np.round(VITESSE_TRAIN / 3.6 * (ecart_us / 1_000_000), 3)
+
+    hauteur = np.round(np.clip(rng.normal(5.5, 0.2, nombre), 4.0, 7.0), 2)
+    deport = np.round(rng.uniform(-0.2, 0.2, nombre), 2) + 0.0  # pas de -0.0
+    ecartement = np.round(rng.uniform(1430, 1440, nombre), 1)
+
+    # defaut_type : indice dans TYPES_ANOMALIES, -1 si pas d'anomalie
+    masque = rng.random(nombre) < TAUX_ANOMALIES
+    nb_anomalies = int(masque.sum())
+    defaut_type = np.full(nombre, -1, dtype=np.int8)
+    defaut_type[masque] = rng.integers(0, len(TypeAnomalie), nb_anomalies)
+    defaut_position = np.full(nombre, np.nan)
+    defaut_position[masque] = np.round(rng.uniform(0, 100, nb_anomalies), 3)
+
+    return {
+        'timestamp': timestamps,
+        'pk_position': pk,
+        'vitesse': np.full(nombre, VITESSE_TRAIN, dtype=np.int16),
+        'hauteur_catenaire': hauteur,
+        'deport_catenaire': deport,
+        'ecartement_voie': ecartement,
+        'defaut_type': defaut_type,
+        'defaut_position': defaut_position,
     }
-    
-    return anomalie
 
-def generer_donnees_ufm160(debut: datetime, duree_heures: float, nom_fichier: str) -> None:
+# Rendu CSV vectorise : chaque champ est une table de chaines pre-formatees (completees par
+# des octets nuls jusqu'a un multiple de 4 octets) indexee par un tableau NumPy. Les lignes
+# sont assemblees dans une matrice de mots de 4 octets dont on retire ensuite les octets nuls.
+
+def _table_mots(chaines: List[str]) -> np.ndarray:
+    largeur = -(-max(len(c) for c in chaines) // 4) * 4
+    table = np.array([c.encode('ascii') for c in chaines], dtype='S%d' % largeur)
+    return table.view('V%d' % largeur)
+
+_GROUPES_TETE = _table_mots([str(i) for i in range(10000)]).view(np.uint32)
+_GROUPES_ZEROS = _table_mots(['%04d' % i for i in range(10000)]).view(np.uint32)
+_TABLE_TYPES = _table_mots([t + ',' for t in TYPES_ANOMALIES])
+_MARQUEUR = b'\x01'
+_FIN_LIGNE = _table_mots([',\r\n', _MARQUEUR.decode()]).view(np.uint32)
+_LIGNES_PAR_BLOC = 65536
+
+@lru_cache(maxsize=None)
+def _table_fractions(decimales: int, separateur: str) -> np.ndarray:
+    # ".889," ".89," ".0," : partie decimale sans zeros de fin, suivie du separateur
+    return _table_mots(['.' + (('%0*d' % (decimales, i)).rstrip('0') or '0') + separateur
+                        for i in range(10 ** decimales)])
+
+_LARGEUR_DOMAINE = 4096
+
+@lru_cache(maxsize=32)
+def _table_domaine(debut: int, decimales: int, separateur: str) -> np.ndarray:
+    # Fenetre fixe de 2 * _LARGEUR_DOMAINE codes alignee sur _LARGEUR_DOMAINE : la cle ne
+    # depend pas des extremes exacts du lot, quelques fenetres suffisent par colonne
+    codes = range(debut, debut + 2 * _LARGEUR_DOMAINE)
+    if decimales:
+        return _table_mots([repr(code / 10 ** decimales) + separateur for code in codes])
+    return _table_mots([str(code) + separateur for code in codes])
+
+def _champ_decimal(valeurs: np.ndarray, decimales: int, separateur: str = ',') -> List[np.ndarray]:
+    # Meme rendu que str(round(x, decimales)) suivi du separateur
+    entiers = np.rint(valeurs * 10 ** decimales).astype(np.int64)
+    minimum, maximum = int(entiers.min()), int(entiers.max())
+
+    debut = minimum // _LARGEUR_DOMAINE * _LARGEUR_DOMAINE
+    if maximum < debut + 2 * _LARGEUR_DOMAINE:
+        # Domaine restreint (hauteur, deport, ecartement, vitesse) : une entree par valeur
+        return [_table_domaine(debut, decimales, separateur)[entiers - debut]]
+
+    # Domaine etendu (PK) : partie entiere par groupes de 4 chiffres, valeurs positives
+    partie_entiere, fraction = np.divmod(entiers, 10 ** decimales)
+    nb_groupes = -(-len(str(int(partie_entiere.max()))) // 4)
+    morceaux = []
+    for groupe in range(nb_groupes):
+        puissance = 10000 ** (nb_groupes - 1 - groupe)
+        chiffres = partie_entiere // puissance % 10000
+        if groupe == nb_groupes - 1:
+            tete = _GROUPES_TETE[chiffres]
+        else:
+            tete = np.where(partie_entiere >= puissance, _GROUPES_TETE[chiffres], 0)
+        morceaux.append(np.where(partie_entiere >= puissance * 10000, _GROUPES_ZEROS[chiffres], tete))
+    if decimales:
+        morceaux.append(_table_fractions(decimales, separateur)[fraction])
+    else:
+        morceaux.append(np.repeat(_table_mots([separateur]), len(entiers)))
+    return morceaux
+
+def _champ_timestamps(timestamps: np.ndarray) -> List[np.ndarray]:
+    # '%Y-%m-%d %H:%M:%S.%f'[:-5] : une table par minute, une table par dixieme de seconde
+    minutes = timestamps.astype('M8[m]')
+    numeros = minutes.astype(np.int64)
+    premiere = int(numeros.min())
+    calendrier = np.datetime_as_string(np.arange(premiere, int(numeros.max()) + 1).astype('M8[m]'))
+    table_minutes = _table_mots([m.replace('T', ' ') for m in calendrier.tolist()])
+    dixiemes = (timestamps - minutes).astype('m8[us]').astype(np.int64) // 100_000
+    table_dixiemes = _table_mots([':%02d.%d,' % (i // 10, i % 10) for i in range(600)])
+    return [table_minutes[numeros - premiere], table_dixiemes[dixiemes]]
+
+def _assembler(morceaux: List[np.ndarray]) -> bytes:
+    largeurs = [m.dtype.itemsize // 4 for m in morceaux]
+    mots = np.empty((len(morceaux[0]), sum(largeurs)), dtype=np.uint32)
+    colonne = 0
+    for morceau, largeur in zip(morceaux, largeurs):
+        emplacement = mots[:, colonne:colonne + largeur].view(morceau.dtype)[:, 0]
+        emplacement[:] = morceau
+        colonne += largeur
+    octets = mots.view(np.uint8).ravel()
+    return octets[octets != 0].tobytes()
+
+def _formater_bloc_csv(lot: Dict[str, np.ndarray]) -> bytes:
+    # Les lignes en anomalie (4%) se terminent par un marqueur, remplace ensuite par leur
+    # "type,position" rendu a part
+    anomalies = lot['defaut_type'] >= 0
+    lignes = _assembler(
+        _champ_timestamps(lot['timestamp'])
+        + _champ_decimal(lot['pk_position'], 3)
+        + _champ_decimal(lot['vitesse'], 0)
+        + _champ_decimal(lot['hauteur_catenaire'], 2)
+        + _champ_decimal(lot['deport_catenaire'], 2)
+        + _champ_decimal(lot['ecartement_voie'], 1)
+        + [_FIN_LIGNE[anomalies.view(np.int8)]]
+    ).split(_MARQUEUR)
+    if len(lignes) == 1:
+        return lignes[0]
+
+    defauts = _assembler(
+        [_TABLE_TYPES[lot['defaut_type'][anomalies]]]
+        + _champ_decimal(lot['defaut_position'][anomalies], 3, separateur='\r\n' + _MARQUEUR.decode())
+    ).split(_MARQUEUR)
+    morceaux = [b''] * (2 * len(lignes) - 1)
+    morceaux[0::2] = lignes
+    morceaux[1::2] = defauts[:-1]
+    return b''.join(morceaux)
+
+def iter_blocs_csv(lot: Dict[str, np.ndarray]) -> Iterator[bytes]:
+    # Blocs de taille fixe : les tableaux intermediaires restent dans le cache
+    for debut in range(0, len(lot['pk_position']), _LIGNES_PAR_BLOC):
+        yield _formater_bloc_csv({nom: colonne[debut:debut + _LIGNES_PAR_BLOC]
+                                  for nom, colonne in lot.items()})
+
+def formater_lot_csv(lot: Dict[str, np.ndarray]) -> bytes:
+    return b''.join(iter_blocs_csv(lot))
+
+def nombre_mesures(duree_heures: float) -> int:
+    return int(duree_heures*3600/INTERVALLE_MESURE)
+
+def iter_mesures(debut: datetime, duree_heures: float, taille_lot: int = TAILLE_LOT,
+                 graine: Optional[int] = None) -> Iterator[Dict[str, np.ndarray]]:
+    # Lots de taille fixe : la memoire ne depend pas de la duree simulee.
+    # Pour une meme graine, le tirage depend aussi de taille_lot.
+    rng = np.random.default_rng(graine)
+    return _iter_lots(debut, 0, nombre_mesures(duree_heures), taille_lot, rng)
+
+def _iter_lots(debut: datetime, indice_depart: int, nombre: int, taille_lot: int,
+               rng: np.random.Generator) -> Iterator[Dict[str, np.ndarray]]:
+    for indice in range(indice_depart, indice_depart + nombre, taille_lot):
+        yield generer_lot(debut, indice, min(taille_lot, indice_depart + nombre - indice), rng)
+
+class Sortie:
+    # Destination des lots produits par iter_mesures
+    def ecrire(self, lot: Dict[str, np.ndarray]) -> None:
+        raise NotImplementedError
+
+    def fermer(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.fermer()
+
+# CSV compresse, choisi par l'extension : .csv.gz (gzip) ou .csv.zst (zstandard, dependance
+# optionnelle). Les colonnes tres repetitives (vitesse constante, PK et horodatages en
+# progression reguliere, defauts vides) se compressent d'un facteur 4 a 10 : moins d'octets a
+# lire sur un partage reseau, au prix d'un peu de CPU a la decompression.
+COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+NIVEAUX_COMPRESSION = {'gzip': 6, 'zstd': 3}  # niveaux par defaut (gzip 1-9, zstd 1-22)
 
+def compression(nom_fichier: str) -> Optional[str]:
+    return COMPRESSIONS.get(os.path.splitext(nom_fichier)[1])
+
+def decouper_extension(nom_fichier: str) -> Tuple[str, str]:
+    # ('data/raw/mesures', '.csv.gz') : l'extension de compression reste avec celle du format
+    racine, extension = os.path.splitext(nom_fichier)
+    if extension in COMPRESSIONS:
+        racine, format_fichier = os.path.splitext(racine)
+        extension = format_fichier + extension
+    return racine, extension
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("Les fichiers .zst necessitent le module zstandard (pip install zstandard)")
+    return zstandard
+
+class _LectureDecompressee(io.RawIOBase):
+    # Flux decompresse dont les erreurs (fichier tronque ou corrompu) sont levees en
+    # ValueError, comme une ligne CSV illisible
+    def __init__(self, flux, erreurs: tuple):
+        self.flux = flux
+        self.erreurs = erreurs
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, tampon) -> int:
+        try:
+            return self.flux.readinto(tampon)
+        except self.erreurs as erreur:
+            raise ValueError(f"Fichier compresse illisible : {erreur}") from erreur
+
+    def close(self) -> None:
+        if not self.closed:
+            self.flux.close()
+        super().close()
+
+class _EcritureGzip(gzip.GzipFile):
+    # En-tete de membre sans date ni nom de fichier : une meme graine donne les memes octets,
+    # compresses ou non (gzip.open y inscrit l'heure et le nom de la tranche)
+    def __init__(self, nom_fichier: str, mode: str, niveau: int):
+        self.fichier = open(nom_fichier, mode)
+        super().__init__(filename='', mode=mode, compresslevel=niveau, fileobj=self.fichier, mtime=0)
+
+    def close(self) -> None:
+        try:
+            super().close()
+        finally:
+            self.fichier.close()
+
+def ouvrir_flux(nom_fichier: str, mode: str = 'rb', niveau: Optional[int] = None):
+    # Fichier binaire ('rb' ou 'wb'), compresse ou decompresse a la volee selon l'extension
+    methode = compression(nom_fichier)
+    if methode is None:
+        return open(nom_fichier, mode)
+    niveau = NIVEAUX_COMPRESSION[methode] if niveau is None else niveau
+    if methode == 'gzip':
+        if mode == 'rb':
+            return io.BufferedReader(_LectureDecompressee(gzip.open(nom_fichier, 'rb'), (EOFError,)))
+        return _EcritureGzip(nom_fichier, mode, niveau)
+    zstandard = _zstandard()
+    if mode == 'rb':
+        # Plusieurs trames a la suite (fichiers concatenes) : lues comme un seul flux
+        lecteur = zstandard.ZstdDecompressor().stream_reader(open(nom_fichier, 'rb'), closefd=True,
+                                                             read_across_frames=True)
+        return io.BufferedReader(_LectureDecompressee(lecteur, (zstandard.ZstdError,)))
+    return zstandard.ZstdCompressor(level=niveau, write_checksum=True).stream_writer(
+        open(nom_fichier, 'wb'), closefd=True)
+
+def ouvrir_texte(nom_fichier: str):
+    # Lecture en flux d'un CSV, compresse ou non
+    if compression(nom_fichier) is None:
+        return open(nom_fichier, 'r', encoding='utf-8')
+    return io.TextIOWrapper(ouvrir_flux(nom_fichier, 'rb'), encoding='utf-8')
+
+class SortieCsv(Sortie):
+    def __init__(self, nom_fichier: str, entete: bool = True, niveau: Optional[int] = None):
+        os.makedirs(os.path.dirname(nom_fichier) or ".", exist_ok=True)
+        self.nom_fichier = nom_fichier
+        self.fichier = ouvrir_flux(nom_fichier, 'wb', niveau)
+        if entete:
+            self.fichier.write((','.join(COLONNES) + '\r\n').encode('utf-8'))
+
+    def ecrire(self, lot: Dict[str, np.ndarray]) -> None:
+        for bloc in iter_blocs_csv(lot):
+            self.fichier.write(bloc)
+
+    def fermer(self) -> None:
+        self.fichier.close()
+
+# Format binaire en colonnes (.ufmb) : en-tete de TAILLE_ENTETE_BINAIRE octets (MAGIC, longueur
+# puis JSON decrivant le nombre de lignes et la position de chaque colonne), suivi des colonnes
+# contigues, alignees sur 64 octets, lisibles sans copie par np.frombuffer sur un mmap.
+EXTENSION_BINAIRE = '.ufmb'
+MAGIC_BINAIRE = b'RAILUFM\x01'
+TAILLE_ENTETE_BINAIRE = 4096
+# Une mesure en memoire : 51 octets (8 + 8 + 2 + 8 + 8 + 8 + 1 + 8), que ce soit une ligne d'un
+# tableau structure DTYPE_MESURE, la meme ligne repartie dans les colonnes d'un Dataset ou
+# d'un .ufmb (une colonne par champ, de meme type). Une ligne CSV lue en dictionnaire de
+# chaines (csv.DictReader) en occupe plus de 600 (benchmark.py empreinte).
+DTYPE_MESURE = np.dtype([
+    ('timestamp', '<M8[ms]'),
+    ('pk_position', '<f8'),
+    ('vitesse', '<i2'),
+    ('hauteur_catenaire', '<f8'),
+    ('deport_catenaire', '<f8'),
+    ('ecartement_voie', '<f8'),
+    ('defaut_type', 'i1'),
+    ('defaut_position', '<f8'),
+])
+
+def vers_enregistrements(lot: Dict[str, np.ndarray]) -> np.ndarray:
+    # Lot en colonnes -> tableau structure DTYPE_MESURE (une ligne de 51 octets par mesure)
+    enregistrements = np.empty(len(lot['pk_position']), dtype=DTYPE_MESURE)
+    for nom in DTYPE_MESURE.names:
+        enregistrements[nom] = lot[nom]
+    return enregistrements
+
+def est_binaire(nom_fichier: str) -> bool:
+    return nom_fichier.endswith(EXTENSION_BINAIRE)
+
+def lire_entete_binaire(fichier) -> Dict[str, Any]:
+    fichier.seek(0)
+    debut = fichier.read(len(MAGIC_BINAIRE) + 4)
+    if debut[:len(MAGIC_BINAIRE)] != MAGIC_BINAIRE:
+        raise ValueError(f"{getattr(fichier, 'name', 'fichier')} n'est pas un fichier {EXTENSION_BINAIRE}")
+    longueur = struct.unpack('<I', debut[len(MAGIC_BINAIRE):])[0]
+    return json.loads(fichier.read(longueur).decode('utf-8'))
+
+class SortieBinaire(Sortie):
+    # La capacite (nombre maximal de lignes) fixe la place reservee a chaque colonne.
+    # L'en-tete est reecrit apres chaque lot : un lecteur voit toujours un nombre de
+    # lignes deja ecrites.
+    def __init__(self, nom_fichier: str, capacite: int, types_anomalies: Optional[List[str]] = None,
+                 metadonnees: Optional[Dict[str, Any]] = None):
+        os.makedirs(os.path.dirname(nom_fichier) or ".", exist_ok=True)
+        self.nom_fichier = nom_fichier
+        self.metadonnees = metadonnees or {}
+        self.capacite = capacite
+        self.nombre = 0
+        self.identifiant = uuid.uuid4().hex
+        self.types_anomalies = list(types_anomalies or TYPES_ANOMALIES)
+
+        self.positions = {}
+        position = TAILLE_ENTETE_BINAIRE
+        for nom in DTYPE_MESURE.names:
+            self.positions[nom] = position
+            position += -(-capacite * DTYPE_MESURE[nom].itemsize // 64) * 64
+
+        self.fichier = open(nom_fichier, 'w+b')
+        self.fichier.truncate(position)
+        self._ecrire_entete()
+
+    def code_type(self, type_anomalie: str) -> int:
+        if type_anomalie not in self.types_anomalies:
+            self.types_anomalies.append(type_anomalie)
+        return self.types_anomalies.index(type_anomalie)
+
+    def _ecrire_entete(self) -> None:
+        entete = json.dumps({
+            'identifiant': self.identifiant,
+            'nombre': self.nombre,
+            'capacite': self.capacite,
+            'types_anomalies': self.types_anomalies,
+            'colonnes': [[nom, DTYPE_MESURE[nom].str, self.positions[nom]] for nom in DTYPE_MESURE.names],
+            'metadonnees': self.metadonnees,
+        }).encode('utf-8')
+        if len(MAGIC_BINAIRE) + 4 + len(entete) > TAILLE_ENTETE_BINAIRE:
+            raise ValueError("En-tete binaire trop long (types d'anomalies trop nombreux)")
+        self.fichier.flush()
+        self.fichier.seek(0)
+        self.fichier.write(MAGIC_BINAIRE + struct.pack('<I', len(entete)) + entete)
+        self.fichier.flush()
+
+    def ecrire(self, lot: Dict[str, np.ndarray]) -> None:
+        nombre = len(lot['pk_position'])
+        if self.nombre + nombre > self.capacite:
+            raise ValueError(f"Capacite du fichier {self.nom_fichier} depassee ({self.capacite} lignes)")
+        for nom in DTYPE_MESURE.names:
+            colonne = np.ascontiguousarray(lot[nom], dtype=DTYPE_MESURE[nom])
+            self.fichier.seek(self.positions[nom] + self.nombre * colonne.itemsize)
+            self.fichier.write(colonne)
+        self.nombre += nombre
+        self._ecrire_entete()
+
+    def fermer(self) -> None:
+        self._ecrire_entete()
+        self.fichier.close()
+
+def ouvrir_sortie(nom_fichier: str, capacite: int, niveau: Optional[int] = None) -> Sortie:
+    # Le format (et la compression, de niveau `niveau`) suit l'extension du fichier
+    if est_binaire(nom_fichier):
+        return SortieBinaire(nom_fichier, capacite)
+    return SortieCsv(nom_fichier, niveau=niveau)
+
+class SortieNulle(Sortie):
+    # Compte les mesures sans rien ecrire (benchmarks)
+    def __init__(self):
+        self.total = 0
+
+    def ecrire(self, lot: Dict[str, np.ndarray]) -> None:
+        self.total += len(lot['pk_position'])
+
+class SortieMultiple(Sortie):
+    def __init__(self, *sorties: Sortie):
+        self.sorties = sorties
+
+    def ecrire(self, lot: Dict[str, np.ndarray]) -> None:
+        for sortie in self.sorties:
+            sortie.ecrire(lot)
+
+    def fermer(self) -> None:
+        for sortie in self.sorties:
+            sortie.fermer()
+
+def ecrire_mesures(lots: Iterable[Dict[str, np.ndarray]], sortie: Sortie,
+                   progression: Optional[Callable[[int], None]] = None) -> int:
+    # progression(total) est appelee apres chaque lot ; une exception levee par
+    # progression interrompt l'ecriture (annulation)
+    total = 0
+    with sortie:
+        for lot in lots:
+            sortie.ecrire(lot)
+            total += len(lot['pk_position'])
+            if progression is not None:
+                progression(total)
+    return total
+
+def _generer_tranche(debut: datetime, indice_depart: int, nombre: int,
+                     graine: np.random.SeedSequence, chemin: str, entete: bool,
+                     niveau: Optional[int] = None) -> str:
+    rng = np.random.default_rng(graine)
+    ecrire_mesures(_iter_lots(debut, indice_depart, nombre, TAILLE_LOT, rng),
+                   SortieCsv(chemin, entete=entete, niveau=niveau))
+    return chemin
+
+def generer_donnees_paralleles(debut: datetime, duree_heures: float, nom_fichier: str,
+                               graine: Optional[int] = None, workers: Optional[int] = None,
+                               concatener: bool = True, niveau: Optional[int] = None) -> List[str]:
+    # Decoupe la periode en `workers` tranches consecutives generees dans des processus
+    # distincts. Chaque tranche a son propre flux aleatoire, derive de la graine : le
+    # resultat est identique pour une meme graine et un meme nombre de workers.
+    # Un CSV compresse l'est aussi par tranche, en parallele : gzip comme zstd lisent une
+    # suite de membres (trames) concatenes comme un seul flux.
+    if est_binaire(nom_fichier):
+        raise ValueError("La generation parallele produit uniquement des fichiers CSV")
+    workers = workers or os.cpu_count() or 1
+    nombre = nombre_mesures(duree_heures)
+    taille_tranche = -(-nombre // workers)
+    graines = np.random.SeedSequence(graine).spawn(workers)
+    racine, extension = decouper_extension(nom_fichier)
+    parties = [f"{racine}.part{numero:04d}{extension}" for numero in range(workers)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        taches = [
+            executor.submit(_generer_tranche, debut, numero * taille_tranche,
+                            max(0, min(taille_tranche, nombre - numero * taille_tranche)),
+                            graines[numero], parties[numero], not concatener, niveau)
+            for numero in range(workers)
+        ]
+        parties = [tache.result() for tache in taches]
+
+    if not concatener:
+        print(f"Fichiers crees : {', '.join(parties)}")
+        return parties
+
+    # En-tete (deja compresse le cas echeant), puis octets des tranches recopies tels quels
+    SortieCsv(nom_fichier, niveau=niveau).fermer()
+    with open(nom_fichier, 'ab') as sortie:
+        for partie in parties:
+            with open(partie, 'rb') as fichier:
+                shutil.copyfileobj(fichier, sortie)
+            os.remove(partie)
+    print(f"Fichier cree : {nom_fichier}")
+    return [nom_fichier]
+
+def generer_donnees_ufm160(debut: datetime, duree_heures: float, nom_fichier: str,
+                           graine: Optional[int] = None, vectorise: bool = True,
+                           niveau: Optional[int] = None) -> None:
+    # niveau : niveau de compression d'un .csv.gz / .csv.zst (defaut NIVEAUX_COMPRESSION)
+
+    if est_binaire(nom_fichier) and not vectorise:
+        raise ValueError("Le format binaire necessite le mode vectorise")
+    if compression(nom_fichier) is not None and not vectorise:
+        raise ValueError("La compression necessite le mode vectorise")
+    if vectorise:
+        ecrire_mesures(iter_mesures(debut, duree_heures, graine=graine),
+                       ouvrir_sortie(nom_fichier, nombre_mesures(duree_heures), niveau))
+        print(f"Fichier cree : {nom_fichier}")
+        return
+    
+    if graine is not None:
+        random.seed(graine)
     
     timestamps = generer_timestamps(debut, duree_heures)
     positions = generer_position_pk(timestamps)
@@ -74,8 +605,7 @@ def generer_donnees_ufm160(debut: datetime, duree_heures: float, nom_fichier: st
     fichier = open(nom_fichier, 'w', newline='', encoding='utf-8')
     writer = csv.writer(fichier)
     
-    writer.writerow(['timestamp', 'pk_position', 'vitesse', 'hauteur_catenaire', 
-                    'deport_catenaire', 'ecartement_voie', 'defaut_type', 'defaut_position'])
+    writer.writerow(COLONNES)
     
     for i in range(len(timestamps)):
         timestamp = timestamps[i]
@@ -87,8 +617,8 @@ def generer_donnees_ufm160(debut: datetime, duree_heures: float, nom_fichier: st
         
         if random.random() < TAUX_ANOMALIES:
             anomalie = generer_anomalie()
-            defaut_type = anomalie['type']
-            defaut_position = anomalie['position']
+            defaut_type = anomalie.type.libelle
+            defaut_position = anomalie.position
         else:
             defaut_type = ''
             defaut_position = ''
@@ -0,0 +1,316 @@
+import io
+import os
+import sys
+import fcntl
+import mmap
+import itertools
+import time
+import threading
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import data_generator
+from metriques import CACHE_DATASET, enregistrer_lecture
+
+CHEMIN_MESURES = os.environ.get('RAILCHECK_MESURES', 'data/raw/mesures_ufm160.csv')
+SUFFIXE_CACHE_BINAIRE = '.cache' + data_generator.EXTENSION_BINAIRE
+DATASETS_MAX = 4  # fichiers gardes en memoire par le cache (les plus anciens lus sont oublies)
+
+DTYPE_CSV = np.dtype([
+    ('timestamp', 'M8[ms]'),
+    ('pk_position', 'f8'),
+    ('vitesse', 'i2'),
+    ('hauteur_catenaire', 'f8'),
+    ('deport_catenaire', 'f8'),
+    ('ecartement_voie', 'f8'),
+    ('defaut_type', 'S32'),
+    ('defaut_position', 'S16'),
+])
+
+
+class Dataset:
+    # Mesures d'un fichier, stockees par colonnes NumPy (memes cles que data_generator.generer_lot).
+    # defaut_type est un indice dans types_anomalies, -1 si la mesure n'a pas d'anomalie.
+    def __init__(self, colonnes: Dict[str, np.ndarray], types_anomalies: List[str],
+                 chemin: str = '', version: Tuple[int, int] = (0, 0)):
+        self.colonnes = colonnes
+        self.types_anomalies = types_anomalies
+        self.chemin = chemin
+        self.version = version
+        self.memo = {}
+
+    def __len__(self) -> int:
+        return len(self.colonnes['pk_position'])
+
+    def __getitem__(self, nom: str) -> np.ndarray:
+        return self.colonnes[nom]
+
+    def calculer(self, cle: str, fonction):
+        # Resultat calcule une seule fois par version du fichier
+        if cle not in self.memo:
+            self.memo[cle] = fonction(self)
+        return self.memo[cle]
+
+
+def version_fichier(chemin: str) -> Tuple[int, int]:
+    infos = os.stat(chemin)
+    return infos.st_mtime_ns, infos.st_size
+
+
+def _encoder_types(libelles: np.ndarray) -> Tuple[np.ndarray, List[str]]:
+    types = list(data_generator.TYPES_ANOMALIES)
+    codes = np.full(len(libelles), -1, dtype=np.int8)
+    for type_anomalie in data_generator.TypeAnomalie:
+        codes[libelles == type_anomalie.libelle.encode('utf-8')] = type_anomalie
+
+    inconnus = (codes < 0) & (libelles != b'')
+    if inconnus.any():
+        autres, indices = np.unique(libelles[inconnus], return_inverse=True)
+        codes[inconnus] = len(types) + indices
+        types += [nom.decode('utf-8') for nom in autres.tolist()]
+    return codes, types
+
+
+def parser_colonnes(source, entete: bool = True) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    # source : chemin, fichier ou lignes de texte au format CSV UFM 160
+    with warnings.catch_warnings():
+        # Aucune mesure : loadtxt previent mais renvoie un tableau vide
+        warnings.simplefilter('ignore', UserWarning)
+        lignes = np.loadtxt(source, delimiter=',', skiprows=1 if entete else 0,
+                            dtype=DTYPE_CSV, encoding='utf-8', ndmin=1)
+
+    codes, types = _encoder_types(lignes['defaut_type'])
+    positions = np.full(len(lignes), np.nan)
+    renseignees = lignes['defaut_position'] != b''
+    positions[renseignees] = lignes['defaut_position'][renseignees].astype(np.float64)
+
+    # Memes types que data_generator.DTYPE_MESURE : 51 octets par mesure une fois lue
+    colonnes = {nom: np.ascontiguousarray(lignes[nom], dtype=data_generator.DTYPE_MESURE[nom])
+                for nom in ('timestamp', 'pk_position', 'vitesse', 'hauteur_catenaire',
+                            'deport_catenaire', 'ecartement_voie')}
+    colonnes['defaut_type'] = codes
+    colonnes['defaut_position'] = positions
+    return colonnes, types
+
+
+def format_lecture(chemin: str) -> str:
+    # Libelle des metriques de lecture : csv, csv_gzip, csv_zstd ou binaire
+    if data_generator.est_binaire(chemin):
+        return 'binaire'
+    methode = data_generator.compression(chemin)
+    return 'csv' if methode is None else f'csv_{methode}'
+
+
+class _LectureBornee(io.RawIOBase):
+    # Les `limite` premiers octets d'un fichier ouvert : ce qui est ajoute ensuite n'est pas lu
+    def __init__(self, fichier, limite: int):
+        self.fichier = fichier
+        self.limite = limite
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, position: int, origine: int = io.SEEK_SET) -> int:
+        if origine != io.SEEK_SET:
+            raise io.UnsupportedOperation("seek depuis le debut seulement")
+        self.position = min(position, self.limite)
+        self.fichier.seek(self.position)
+        return self.position
+
+    def readinto(self, tampon) -> int:
+        nombre = self.fichier.readinto(memoryview(tampon)[:self.limite - self.position])
+        self.position += nombre
+        return nombre
+
+    def close(self) -> None:
+        self.fichier.close()
+        super().close()
+
+
+def _fin_lignes_completes(fichier, taille: int, bloc: int = 1 << 16) -> int:
+    # Position qui suit la derniere fin de ligne des `taille` premiers octets
+    fin = taille
+    while fin > 0:
+        debut = max(fin - bloc, 0)
+        fichier.seek(debut)
+        position = fichier.read(fin - debut).rfind(b'\n')
+        if position >= 0:
+            return debut + position + 1
+        fin = debut
+    return 0
+
+
+def ouvrir_instantane(chemin: str) -> Tuple[io.BufferedReader, Tuple[int, int]]:
+    # Flux binaire d'un CSV arrete a sa derniere ligne complete, et la version du fichier au
+    # meme instant. Une ligne que l'UFM n'a ecrite qu'en partie (fichier alimente en continu)
+    # est laissee pour la lecture suivante, comme dans SuiviFichier.lire_nouveautes. Un CSV
+    # compresse est lu en entier : il est ecrit sous un autre nom puis renomme.
+    if data_generator.compression(chemin) is not None:
+        version = version_fichier(chemin)
+        return data_generator.ouvrir_flux(chemin), version
+    fichier = open(chemin, 'rb')
+    infos = os.fstat(fichier.fileno())
+    fin = _fin_lignes_completes(fichier, infos.st_size)
+    fichier.seek(0)
+    return io.BufferedReader(_LectureBornee(fichier, fin)), (infos.st_mtime_ns, infos.st_size)
+
+
+def lire_csv(chemin: str) -> Dataset:
+    # CSV compresse (.csv.gz, .csv.zst) decompresse en flux, sans fichier intermediaire
+    debut = time.perf_counter()
+    flux, version = ouvrir_instantane(chemin)
+    with io.TextIOWrapper(flux, encoding='utf-8') as source:
+        colonnes, types = parser_colonnes(source)
+    enregistrer_lecture(format_lecture(chemin), len(colonnes['pk_position']), version[1],
+                        time.perf_counter() - debut)
+    return Dataset(colonnes, types, chemin, version)
+
+
+def lire_binaire(chemin: str) -> Dataset:
+    # Colonnes projetees en memoire sans copie : seules les pages lues sont chargees
+    debut = time.perf_counter()
+    version = version_fichier(chemin)
+    with open(chemin, 'rb') as fichier:
+        entete = data_generator.lire_entete_binaire(fichier)
+        carte = mmap.mmap(fichier.fileno(), 0, access=mmap.ACCESS_READ)
+    colonnes = {nom: np.frombuffer(carte, dtype=dtype, count=entete['nombre'], offset=position)
+                for nom, dtype, position in entete['colonnes']}
+    enregistrer_lecture('binaire', entete['nombre'], version[1], time.perf_counter() - debut)
+    return Dataset(colonnes, entete['types_anomalies'], chemin, version)
+
+
+def lire_fichier(chemin: str) -> Dataset:
+    if data_generator.est_binaire(chemin):
+        return lire_binaire(chemin)
+    return lire_csv(chemin)
+
+
+def _compter_fins_ligne(flux) -> int:
+    return sum(bloc.count(b'\n') for bloc in iter(lambda: flux.read(1 << 20), b''))
+
+
+def compter_lignes(chemin: str) -> int:
+    with data_generator.ouvrir_flux(chemin) as fichier:
+        return _compter_fins_ligne(fichier)
+
+
+def convertir_csv_binaire(chemin_csv: str, chemin_binaire: str, taille_lot: int = 65536,
+                          metadonnees: Optional[dict] = None) -> int:
+    # Conversion en flux : la memoire utilisee ne depend que de taille_lot. Le comptage des
+    # lignes (capacite du fichier binaire) et la lecture portent sur le meme instantane du CSV,
+    # dont la version est enregistree dans les metadonnees (version_source) : des lignes
+    # ajoutees pendant la conversion ne depassent pas la capacite
+    flux, version = ouvrir_instantane(chemin_csv)
+    if flux.seekable():
+        capacite = _compter_fins_ligne(flux)
+        flux.seek(0)
+    else:
+        # CSV compresse : ecrit puis renomme, il ne change pas entre les deux lectures
+        capacite = compter_lignes(chemin_csv)
+    metadonnees = dict(metadonnees or {}, version_source=list(version))
+    with io.TextIOWrapper(flux, encoding='utf-8') as source, \
+            data_generator.SortieBinaire(chemin_binaire, max(capacite - 1, 0),
+                                         metadonnees=metadonnees) as sortie:
+        source.readline()
+        while True:
+            lignes = list(itertools.islice(source, taille_lot))
+            if not lignes:
+                break
+            colonnes, types = parser_colonnes(lignes, entete=False)
+            # Les codes du lot sont renumerotes selon les types connus du fichier binaire
+            correspondance = np.array([sortie.code_type(nom) for nom in types] + [-1], dtype=np.int8)
+            colonnes['defaut_type'] = correspondance[colonnes['defaut_type']]
+            sortie.ecrire(colonnes)
+        return sortie.nombre
+
+
+def _version_source(chemin_binaire: str) -> Optional[List[int]]:
+    # Version du CSV dont un .ufmb a ete converti, None si la copie est absente ou illisible
+    try:
+        with open(chemin_binaire, 'rb') as fichier:
+            return data_generator.lire_entete_binaire(fichier).get('metadonnees', {}).get('version_source')
+    except (OSError, ValueError):
+        return None
+
+
+def preparer_cache_binaire(chemin_csv: str) -> Tuple[str, Tuple[int, int]]:
+    # Copie .ufmb d'un CSV, a cote de lui, refaite seulement si le CSV a change. Plusieurs
+    # processus (workers gunicorn) projettent la meme copie : les pages sont partagees par
+    # le cache du systeme au lieu d'etre dupliquees dans chaque processus. Renvoie aussi la
+    # version du CSV que la copie contient.
+    chemin_binaire = chemin_csv + SUFFIXE_CACHE_BINAIRE
+    with open(chemin_binaire + '.verrou', 'w') as verrou:
+        # Un seul processus convertit, les autres attendent puis reutilisent la copie
+        fcntl.flock(verrou, fcntl.LOCK_EX)
+        version = _version_source(chemin_binaire)
+        if version != list(version_fichier(chemin_csv)):
+            temporaire = f"{chemin_csv}.{os.getpid()}.tmp{data_generator.EXTENSION_BINAIRE}"
+            convertir_csv_binaire(chemin_csv, temporaire)
+            version = _version_source(temporaire)
+            os.replace(temporaire, chemin_binaire)
+    return chemin_binaire, tuple(version)
+
+
+class CacheDataset:
+    # Garde en memoire le dernier Dataset lu par chemin ; il est relu des que la date de
+    # modification ou la taille du fichier change.
+    # Avec partage=True, un CSV est lu a travers sa copie .ufmb projetee en memoire
+    # (preparer_cache_binaire), partagee entre processus.
+    def __init__(self, partage: bool = False, datasets_max: int = DATASETS_MAX):
+        self.datasets = {}
+        self.partage = partage
+        self.datasets_max = datasets_max
+        self.verrou = threading.Lock()
+
+    def lire(self, chemin: str) -> Dataset:
+        if not self.partage or data_generator.est_binaire(chemin):
+            return lire_fichier(chemin)
+        chemin_binaire, version = preparer_cache_binaire(chemin)
+        dataset = lire_binaire(chemin_binaire)
+        # Invalide sur la version du CSV source, pas sur celle de la copie
+        dataset.chemin, dataset.version = chemin, version
+        return dataset
+
+    def obtenir(self, chemin: Optional[str] = None) -> Dataset:
+        chemin = chemin or CHEMIN_MESURES
+        with self.verrou:
+            dataset = self.datasets.get(chemin)
+            if dataset is None or dataset.version != version_fichier(chemin):
+                CACHE_DATASET.labels('miss').inc()
+                dataset = self.lire(chemin)
+                self.datasets.pop(chemin, None)
+                self.datasets[chemin] = dataset
+                while len(self.datasets) > self.datasets_max:
+                    del self.datasets[next(iter(self.datasets))]
+            else:
+                CACHE_DATASET.labels('hit').inc()
+            return dataset
+
+    def vider(self) -> None:
+        with self.verrou:
+            self.datasets.clear()
+
+
+cache = CacheDataset(partage=os.environ.get('RAILCHECK_CACHE_PARTAGE', '') not in ('', '0'))
+
+
+def charger_dataset(chemin: Optional[str] = None) -> Dataset:
+    return cache.obtenir(chemin)
+
+
+if __name__ == '__main__':
+    # python src/dataset.py mesures.csv mesures.ufmb
+    if len(sys.argv) != 3:
+        print("Usage : python src/dataset.py <fichier.csv> <fichier.ufmb>")
+        sys.exit(1)
+    total = convertir_csv_binaire(sys.argv[1], sys.argv[2])
+    print(f"Fichier cree : {sys.argv[2]} ({total} mesures)")
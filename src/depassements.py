@@ -0,0 +1,229 @@
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from data_generator import Sortie
+
+
+# Tolerances par colonne : bornes absolues et variation maximale entre deux mesures
+# consecutives, par metre parcouru
+@dataclass(frozen=True)
+class RegleTolerance:
+    minimum: float
+    maximum: float
+    variation_max: Optional[float] = None  # unite de la colonne par metre
+
+
+REGLES = {
+    'hauteur_catenaire': RegleTolerance(4.0, 7.0),  # m
+    'deport_catenaire': RegleTolerance(-0.4, 0.4, variation_max=0.15),  # m, m/m
+    'ecartement_voie': RegleTolerance(1428.0, 1470.0, variation_max=3.0),  # mm, mm/m
+}
+COLONNES_SURVEILLEES = list(REGLES)
+TYPES_REGLES = ['minimum', 'maximum', 'variation', 'ecart_statistique']
+FENETRE = 256  # mesures de la moyenne / ecart-type glissants
+ECARTS_TYPES = 5.0  # ecart a la moyenne glissante, en ecarts-types, au-dela duquel on alerte
+EVENEMENTS_MAX = 10000  # derniers depassements gardes en memoire
+
+DTYPE_DEPASSEMENT = np.dtype([
+    ('pk', 'f8'),
+    ('timestamp', 'M8[ms]'),
+    ('colonne', 'i1'),  # indice dans COLONNES_SURVEILLEES
+    ('regle', 'i1'),  # indice dans TYPES_REGLES
+    ('valeur', 'f8'),
+    ('limite', 'f8'),
+])
+
+
+@dataclass
+class Depassements:
+    # Instantane des depassements : derniers evenements (ordre d'arrivee) et totaux par
+    # (colonne, regle) depuis le debut du fichier
+    evenements: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=DTYPE_DEPASSEMENT))
+    compteurs: Dict[Tuple[str, str], int] = field(default_factory=dict)
+
+    @property
+    def total(self) -> int:
+        return sum(self.compteurs.values())
+
+    def filtrer(self, pk_min: float = float('-inf'), pk_max: float = float('inf'),
+                colonne: Optional[str] = None, regle: Optional[str] = None) -> np.ndarray:
+        # ValueError si la colonne ou la regle n'existe pas
+        masque = (self.evenements['pk'] >= pk_min) & (self.evenements['pk'] <= pk_max)
+        if colonne is not None:
+            masque &= self.evenements['colonne'] == COLONNES_SURVEILLEES.index(colonne)
+        if regle is not None:
+            masque &= self.evenements['regle'] == TYPES_REGLES.index(regle)
+        return self.evenements[masque]
+
+
+class _EtatColonne:
+    # Etat d'une colonne entre deux lots : les FENETRE dernieres valeurs (moyenne et
+    # ecart-type glissants) et une valeur de reference qui centre les sommes cumulees
+    def __init__(self):
+        self.reste = np.zeros(0)
+        self.reference: Optional[float] = None
+
+
+class DetecteurDepassements:
+    # Controle en ligne des colonnes de mesure, lot par lot : memoire constante (FENETRE
+    # valeurs par colonne, EVENEMENTS_MAX evenements) quelle que soit la longueur parcourue,
+    # calculs vectorises sur le lot (sommes cumulees pour les statistiques glissantes).
+    # Regles : bornes absolues, variation par metre entre deux mesures consecutives, ecart a
+    # la moyenne des FENETRE mesures precedentes superieur a ECARTS_TYPES ecarts-types.
+    def __init__(self, regles: Dict[str, RegleTolerance] = REGLES, fenetre: int = FENETRE,
+                 ecarts_types: float = ECARTS_TYPES, evenements_max: int = EVENEMENTS_MAX):
+        self.regles = regles
+        self.fenetre = fenetre
+        self.ecarts_types = ecarts_types
+        self.evenements_max = evenements_max
+        self.reinitialiser()
+
+    def reinitialiser(self) -> None:
+        self.etats = {colonne: _EtatColonne() for colonne in self.regles}
+        self.dernier_pk: Optional[float] = None
+        self.evenements = np.zeros(0, dtype=DTYPE_DEPASSEMENT)
+        self.compteurs: Dict[Tuple[str, str], int] = {}
+
+    def ajouter(self, colonnes: Dict[str, np.ndarray]) -> int:
+        # Renvoie le nombre de depassements du lot
+        pk = colonnes['pk_position']
+        if len(pk) == 0:
+            return 0
+        # Variation par metre : ecart de PK avec la mesure precedente (lot precedent compris) ;
+        # un PK qui n'avance pas ne donne pas de variation
+        ecarts_pk = np.diff(pk, prepend=pk[0] if self.dernier_pk is None else self.dernier_pk)
+        avance = ecarts_pk > 0
+
+        lignes, codes_colonnes, codes_regles, valeurs, limites = [], [], [], [], []
+
+        def signaler(indices, colonne, regle, valeurs_lot, limite):
+            lignes.append(indices)
+            codes_colonnes.append(np.full(len(indices), COLONNES_SURVEILLEES.index(colonne), np.int8))
+            codes_regles.append(np.full(len(indices), TYPES_REGLES.index(regle), np.int8))
+            valeurs.append(valeurs_lot[indices])
+            limites.append(np.broadcast_to(limite, len(pk))[indices])
+            if len(indices):
+                cle = (colonne, regle)
+                self.compteurs[cle] = self.compteurs.get(cle, 0) + len(indices)
+
+        for colonne, regle in self.regles.items():
+            if colonne not in colonnes:
+                continue
+            valeurs_lot = np.asarray(colonnes[colonne], dtype=np.float64)
+            etat = self.etats[colonne]
+
+            signaler(np.flatnonzero(valeurs_lot < regle.minimum), colonne, 'minimum',
+                     valeurs_lot, regle.minimum)
+            signaler(np.flatnonzero(valeurs_lot > regle.maximum), colonne, 'maximum',
+                     valeurs_lot, regle.maximum)
+
+            if regle.variation_max is not None:
+                precedentes = np.concatenate([etat.reste[-1:] if len(etat.reste) else valeurs_lot[:1],
+                                              valeurs_lot[:-1]])
+                variation = np.zeros(len(pk))
+                variation[avance] = np.abs(valeurs_lot - precedentes)[avance] / ecarts_pk[avance]
+                signaler(np.flatnonzero(variation > regle.variation_max), colonne, 'variation',
+                         variation, regle.variation_max)
+
+            # Moyenne et ecart-type des `fenetre` valeurs precedant chaque mesure, par
+            # differences de sommes cumulees (centrees pour limiter les erreurs d'arrondi)
+            if etat.reference is None:
+                etat.reference = float(valeurs_lot[0])
+            serie = np.concatenate([etat.reste, valeurs_lot]) - etat.reference
+            sommes = np.concatenate([[0.0], np.cumsum(serie)])
+            sommes_carres = np.concatenate([[0.0], np.cumsum(serie * serie)])
+            positions = np.arange(len(etat.reste), len(serie))
+            debuts = positions - self.fenetre
+            completes = debuts >= 0
+            positions, debuts = positions[completes], debuts[completes]
+            if len(positions):
+                moyennes = (sommes[positions] - sommes[debuts]) / self.fenetre
+                variances = (sommes_carres[positions] - sommes_carres[debuts]) / self.fenetre \
+                    - moyennes ** 2
+                ecarts = np.sqrt(np.maximum(variances, 0.0))
+                distances = serie[positions] - moyennes
+                hors_norme = (ecarts > 0) & (np.abs(distances) > self.ecarts_types * ecarts)
+                indices = positions[hors_norme] - len(etat.reste)
+                # Limite franchie : moyenne glissante +/- ECARTS_TYPES ecarts-types
+                seuils = np.zeros(len(pk))
+                seuils[indices] = etat.reference + moyennes[hors_norme] \
+                    + np.sign(distances[hors_norme]) * self.ecarts_types * ecarts[hors_norme]
+                signaler(indices, colonne, 'ecart_statistique', valeurs_lot, seuils)
+            etat.reste = serie[-self.fenetre:] + etat.reference
+
+        self.dernier_pk = float(pk[-1])
+        lignes = np.concatenate(lignes) if lignes else np.zeros(0, dtype=np.intp)
+        if len(lignes) == 0:
+            return 0
+
+        # Evenements du lot dans l'ordre des mesures, ajoutes a l'anneau des derniers evenements
+        ordre = np.argsort(lignes, kind='stable')
+        lignes = lignes[ordre]
+        nouveaux = np.zeros(len(lignes), dtype=DTYPE_DEPASSEMENT)
+        nouveaux['pk'] = pk[lignes]
+        if 'timestamp' in colonnes:
+            nouveaux['timestamp'] = colonnes['timestamp'][lignes].astype('M8[ms]')
+        else:
+            nouveaux['timestamp'] = np.datetime64('NaT')
+        nouveaux['colonne'] = np.concatenate(codes_colonnes)[ordre]
+        nouveaux['regle'] = np.concatenate(codes_regles)[ordre]
+        nouveaux['valeur'] = np.concatenate(valeurs)[ordre]
+        nouveaux['limite'] = np.concatenate(limites)[ordre]
+        self.evenements = np.concatenate([self.evenements, nouveaux])[-self.evenements_max:]
+        return len(lignes)
+
+    def instantane(self) -> Depassements:
+        return Depassements(self.evenements.copy(), dict(self.compteurs))
+
+    def etat(self) -> Dict[str, np.ndarray]:
+        # Tableaux a passer a np.savez (prefixe depassements_)
+        etat = {
+            'depassements_evenements': self.evenements,
+            'depassements_compteurs': np.array(
+                [[COLONNES_SURVEILLEES.index(colonne), TYPES_REGLES.index(regle), nombre]
+                 for (colonne, regle), nombre in self.compteurs.items()], dtype=np.int64).reshape(-1, 3),
+            'depassements_dernier_pk': np.array(np.nan if self.dernier_pk is None else self.dernier_pk),
+        }
+        for colonne, etat_colonne in self.etats.items():
+            etat[f'depassements_reste_{colonne}'] = etat_colonne.reste
+            etat[f'depassements_reference_{colonne}'] = np.array(
+                np.nan if etat_colonne.reference is None else etat_colonne.reference)
+        return etat
+
+    def restaurer(self, etat) -> None:
+        # Un etat enregistre sans depassements (version precedente) repart de zero
+        self.reinitialiser()
+        if 'depassements_evenements' not in etat:
+            return
+        self.evenements = etat['depassements_evenements']
+        self.compteurs = {(COLONNES_SURVEILLEES[colonne], TYPES_REGLES[regle]): int(nombre)
+                          for colonne, regle, nombre in etat['depassements_compteurs']}
+        dernier_pk = float(etat['depassements_dernier_pk'])
+        self.dernier_pk = None if np.isnan(dernier_pk) else dernier_pk
+        for colonne, etat_colonne in self.etats.items():
+            etat_colonne.reste = etat[f'depassements_reste_{colonne}']
+            reference = float(etat[f'depassements_reference_{colonne}'])
+            etat_colonne.reference = None if np.isnan(reference) else reference
+
+
+class SortieDetection(Sortie):
+    # Controle les lots d'un generateur (ecrire_mesures) au fil de l'eau, par exemple avec
+    # SortieMultiple(SortieCsv(...), SortieDetection(detecteur))
+    def __init__(self, detecteur: Optional[DetecteurDepassements] = None):
+        self.detecteur = detecteur or DetecteurDepassements()
+
+    def ecrire(self, lot: Dict[str, np.ndarray]) -> None:
+        self.detecteur.ajouter(lot)
+
+
+def depassement_json(evenement) -> Dict[str, object]:
+    return {
+        'pk': round(float(evenement['pk']), 3),
+        'timestamp': None if np.isnat(evenement['timestamp']) else str(evenement['timestamp']),
+        'colonne': COLONNES_SURVEILLEES[evenement['colonne']],
+        'regle': TYPES_REGLES[evenement['regle']],
+        'valeur': round(float(evenement['valeur']), 4),
+        'limite': round(float(evenement['limite']), 4),
+    }
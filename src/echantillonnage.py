@@ -0,0 +1,61 @@
+from typing import Tuple
+
+import numpy as np
+
+POINTS_SERIE = 2000  # points par defaut d'une serie reduite (ordre de grandeur d'une largeur d'ecran)
+METHODES = ('minmax', 'lttb')
+
+
+def reduire_min_max(x: np.ndarray, y: np.ndarray, points: int = POINTS_SERIE) -> Tuple[np.ndarray, np.ndarray]:
+    # Garde le minimum et le maximum de chaque seau de mesures consecutives : les pics
+    # (depassements des limites EN 13848) restent visibles quelle que soit la reduction.
+    n = len(y)
+    if n <= points:
+        return x, y
+    seaux = max(points // 2, 1)
+    taille = -(-n // seaux)
+    complets = n // taille * taille
+
+    # Seaux complets : vue (seaux, taille) sans copie, puis dernier seau partiel
+    grille = y[:complets].reshape(-1, taille)
+    departs = np.arange(0, complets, taille)
+    indices = [departs + grille.argmin(axis=1), departs + grille.argmax(axis=1)]
+    if complets < n:
+        reste = y[complets:]
+        indices.append(np.array([complets + reste.argmin(), complets + reste.argmax()]))
+    indices = np.unique(np.concatenate(indices))
+    return x[indices], y[indices]
+
+
+def reduire_lttb(x: np.ndarray, y: np.ndarray, points: int = POINTS_SERIE) -> Tuple[np.ndarray, np.ndarray]:
+    # Largest-Triangle-Three-Buckets : dans chaque seau, le point qui forme le plus grand
+    # triangle avec le point retenu precedemment et la moyenne du seau suivant.
+    n = len(y)
+    if n <= points or points < 3:
+        return x, y
+    bornes = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    indices = np.empty(points, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    precedent = 0
+    for seau in range(points - 2):
+        debut, fin = bornes[seau], bornes[seau + 1]
+        if seau + 2 < len(bornes):
+            suivant = slice(bornes[seau + 1], bornes[seau + 2])
+            x_moyen, y_moyen = x[suivant].mean(), y[suivant].mean()
+        else:
+            x_moyen, y_moyen = x[n - 1], y[n - 1]
+        xa, ya = x[precedent], y[precedent]
+        aires = np.abs((xa - x_moyen) * (y[debut:fin] - ya) - (xa - x[debut:fin]) * (y_moyen - ya))
+        precedent = debut + int(aires.argmax())
+        indices[seau + 1] = precedent
+    return x[indices], y[indices]
+
+
+def reduire_serie(x: np.ndarray, y: np.ndarray, points: int = POINTS_SERIE,
+                  methode: str = 'minmax') -> Tuple[np.ndarray, np.ndarray]:
+    if methode == 'minmax':
+        return reduire_min_max(x, y, points)
+    if methode == 'lttb':
+        return reduire_lttb(x, y, points)
+    raise ValueError(f"Methode de reduction inconnue : {methode} ({', '.join(METHODES)})")
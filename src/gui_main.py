@@ -1,18 +1,248 @@
+import os
 import sys
-import csv
+import threading
 from datetime import datetime
+
+import numpy as np
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QPushButton, QLabel, QTabWidget, 
-                             QTableWidget, QTableWidgetItem, QTextEdit, QScrollArea,
-                             QDialog, QHeaderView)
-from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QFont, QPixmap
-
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+                             QTableView, QTextEdit, QScrollArea,
+                             QDialog, QHeaderView, QLineEdit, QProgressBar, QComboBox)
+from PyQt5.QtCore import (Qt, QObject, QRunnable, QThreadPool, QAbstractTableModel, QModelIndex,
+                          pyqtSignal)
+from PyQt5.QtGui import QFont
 
 import data_generator
+from analytics import obtenir_kpis
+from dataset import charger_dataset
+from index_pk import sous_dataset, resumer_segments
+from echantillonnage import reduire_min_max
+from catalogue import lister_runs
+
+LIGNE_GENERATION = "L830000"  # ligne des runs generes (nom de fichier, voir data_generator.chemin_run)
+DUREE_GENERATION = 0.1  # heures
+
+class TacheAnnulee(Exception):
+    pass
+
+class SignauxTache(QObject):
+    progression = pyqtSignal(int, str)
+    resultat = pyqtSignal(object)
+    erreur = pyqtSignal(str)
+    fin = pyqtSignal()
+
+class Tache(QRunnable):
+    # Execute fonction(tache) dans le QThreadPool. La fonction ne touche a aucun widget :
+    # progression et resultat reviennent au thread de l'interface par signaux.
+    def __init__(self, fonction):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.fonction = fonction
+        self.signaux = SignauxTache()
+        self.annulee = threading.Event()
+        self.echec = False
+    
+    def progresser(self, pourcentage, message=""):
+        # Point d'annulation : appele regulierement par la fonction
+        if self.annulee.is_set():
+            raise TacheAnnulee()
+        self.signaux.progression.emit(int(pourcentage), message)
+    
+    def annuler(self):
+        self.annulee.set()
+    
+    def run(self):
+        try:
+            resultat = self.fonction(self)
+        except TacheAnnulee:
+            pass
+        except Exception as erreur:
+            self.echec = True
+            self.signaux.erreur.emit(str(erreur))
+        else:
+            self.signaux.resultat.emit(resultat)
+        finally:
+            self.signaux.fin.emit()
+
+def tache_generation(tache):
+    # Chaque generation est un nouveau run du catalogue. Ecrit dans un fichier temporaire
+    # renomme a la fin : une annulation ne laisse pas de run incomplet
+    nombre = data_generator.nombre_mesures(DUREE_GENERATION)
+    debut = datetime.now().replace(microsecond=0)
+    chemin = data_generator.chemin_run(debut, LIGNE_GENERATION)
+    dossier, nom = os.path.split(chemin)
+    os.makedirs(dossier, exist_ok=True)
+    temporaire = os.path.join(dossier, '.en_cours_' + nom)
+    try:
+        data_generator.ecrire_mesures(
+            data_generator.iter_mesures(debut, DUREE_GENERATION),
+            data_generator.ouvrir_sortie(temporaire, nombre),
+            progression=lambda total: tache.progresser(total * 90 / nombre, "Generation..."))
+    except BaseException:
+        if os.path.exists(temporaire):
+            os.remove(temporaire)
+        raise
+    os.replace(temporaire, chemin)
+    tache.progresser(90, "Lecture du fichier genere")
+    return chemin, len(charger_dataset(chemin))
+
+def tache_analyse(tache, chemin, fenetre):
+    tache.progresser(0, "Lecture des mesures")
+    dataset = charger_dataset(chemin)
+    tache.progresser(60, "Calcul des KPIs")
+    resume_fenetre = None
+    if fenetre is not None:
+        dataset = sous_dataset(dataset, *fenetre)
+        resume_fenetre = (len(dataset), len(resumer_segments(dataset)))
+    kpis = obtenir_kpis(dataset)
+    tache.progresser(100)
+    return kpis, resume_fenetre
+
+def tache_visualisation(tache, chemin):
+    # Preparation des donnees seulement : le trace se fait dans le thread de l'interface
+    tache.progresser(0, "Lecture des mesures")
+    dataset = charger_dataset(chemin)
+    compteur_anomalies = obtenir_kpis(dataset).compteur_anomalies
+    
+    # Toute la marche, reduite a ~2 points par pixel (min/max par seau : pics conserves)
+    tache.progresser(60, "Reduction de la serie")
+    positions, hauteurs = reduire_min_max(dataset['pk_position'], dataset['hauteur_catenaire'])
+
+    # matplotlib n'est importe qu'au premier graphique ; l'importer ici (hors du thread de
+    # l'interface) evite de figer la fenetre quand les figures sont construites
+    tache.progresser(90, "Chargement de matplotlib")
+    import matplotlib.figure
+    import matplotlib.backends.backend_qt5agg
+    tache.progresser(100)
+    return positions, hauteurs, compteur_anomalies
+
+class GraphiquesMesures:
+    # Figures integrees (FigureCanvasQTAgg), construites une seule fois : un
+    # rafraichissement met a jour les donnees des artistes existants puis redessine,
+    # sans fichier intermediaire. Marges fixes : pas de tight_layout a chaque trace.
+    # Construites au premier trace : matplotlib (plus de la moitie du temps d'import de
+    # l'interface) n'est pas charge avant l'affichage de la fenetre.
+    def __init__(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+
+        # Graphique 1: Hauteur catenaire
+        self.figure_hauteurs = Figure(figsize=(11, 4.5), dpi=100)
+        self.canvas_hauteurs = FigureCanvasQTAgg(self.figure_hauteurs)
+        self.canvas_hauteurs.setMinimumSize(1100, 450)
+        ax1 = self.ax_hauteurs = self.figure_hauteurs.subplots()
+        self.ligne_hauteurs, = ax1.plot([], [], linewidth=1, color='#2196f3', alpha=0.8)
+        ax1.axhline(y=5.5, color='#4caf50', linestyle='--', linewidth=1.5, label='Hauteur standard (5.5m)')
+        ax1.axhline(y=4.0, color='#f44336', linestyle='--', linewidth=1, alpha=0.6, label='Limite min (4.0m)')
+        ax1.axhline(y=7.0, color='#f44336', linestyle='--', linewidth=1, alpha=0.6, label='Limite max (7.0m)')
+        ax1.axhspan(4.0, 7.0, alpha=0.05, color='#4caf50')
+        ax1.set_xlabel('Position (m)', fontsize=11)
+        ax1.set_ylabel('Hauteur catenaire (m)', fontsize=11)
+        ax1.set_title('Mesures UFM 160', fontsize=12, fontweight='bold')
+        ax1.grid(True, alpha=0.3, linestyle=':')
+        ax1.legend(fontsize=9)
+        self.figure_hauteurs.subplots_adjust(left=0.07, right=0.98, bottom=0.12, top=0.92)
+        
+        # Graphique 2: Anomalies
+        self.figure_anomalies = Figure(figsize=(11, 4.5), dpi=100)
+        self.canvas_anomalies = FigureCanvasQTAgg(self.figure_anomalies)
+        self.canvas_anomalies.setMinimumSize(1100, 450)
+        ax2 = self.ax_anomalies = self.figure_anomalies.subplots()
+        ax2.set_xlabel('Type anomalie', fontsize=11)
+        ax2.set_ylabel('Nombre', fontsize=11)
+        ax2.set_title('Inspection ferroviaire', fontsize=12, fontweight='bold')
+        ax2.grid(True, alpha=0.3, linestyle=':', axis='y')
+        self.figure_anomalies.subplots_adjust(left=0.07, right=0.98, bottom=0.12, top=0.92)
+        self.types = []
+        self.barres = []
+        self.etiquettes = []
+    
+    def _construire_barres(self, types):
+        # Seulement si la liste des types change
+        for artiste in self.barres + self.etiquettes:
+            artiste.remove()
+        colors = ['#f44336', '#ff9800', '#ffc107']
+        self.barres = list(self.ax_anomalies.bar(range(len(types)), [0] * len(types), color=colors,
+                                                 edgecolor='#333', linewidth=1.2, alpha=0.85))
+        self.etiquettes = [self.ax_anomalies.text(bar.get_x() + bar.get_width()/2., 0, '',
+                                                  ha='center', va='bottom', fontweight='bold', fontsize=11)
+                           for bar in self.barres]
+        self.ax_anomalies.set_xticks(range(len(types)), types)
+        self.types = types
+    
+    def mettre_a_jour(self, positions, hauteurs, compteur_anomalies):
+        self.ligne_hauteurs.set_data(positions, hauteurs)
+        self.ax_hauteurs.relim()
+        self.ax_hauteurs.autoscale_view()
+        
+        types = list(compteur_anomalies.keys())
+        if types != self.types:
+            self._construire_barres(types)
+        for bar, etiquette, count in zip(self.barres, self.etiquettes, compteur_anomalies.values()):
+            bar.set_height(count)
+            etiquette.set_y(count)
+            etiquette.set_text(f'{int(count)}')
+        self.ax_anomalies.relim()
+        self.ax_anomalies.autoscale_view()
+    
+    def dessiner(self):
+        self.canvas_hauteurs.draw()
+        self.canvas_anomalies.draw()
+
+class ModeleColonnes(QAbstractTableModel):
+    # Table en lecture seule adossee a des tableaux NumPy : aucun objet Qt par cellule,
+    # le texte n'est formate que pour les lignes affichees. Le tri ne deplace pas les
+    # donnees, il remplace seulement la permutation `ordre`.
+    def __init__(self, entetes, formats, parent=None):
+        super().__init__(parent)
+        self.entetes = entetes
+        self.formats = formats
+        self.colonnes = [np.empty(0) for _ in entetes]
+        self.ordre = np.empty(0, dtype=np.int64)
+        self.tris = {}  # id(colonne) -> permutation croissante, calculee au premier tri
+    
+    def remplacer(self, colonnes):
+        # Une colonne peut etre partagee (meme tableau, formats differents)
+        self.beginResetModel()
+        self.colonnes = [np.asarray(colonne) for colonne in colonnes]
+        self.ordre = np.arange(len(self.colonnes[0]))
+        self.tris = {}
+        self.endResetModel()
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ordre)
+    
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entetes)
+    
+    def valeur(self, ligne, colonne):
+        return self.colonnes[colonne][self.ordre[ligne]]
+    
+    def data(self, index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not index.isValid():
+            return None
+        return self.formats[index.column()](self.valeur(index.row(), index.column()))
+    
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.entetes[section]
+        return str(section + 1)
+    
+    def sort(self, colonne, ordre=Qt.AscendingOrder):
+        valeurs = self.colonnes[colonne]
+        permutation = self.tris.get(id(valeurs))
+        if permutation is None:
+            # Les positions des KPIs sont deja dans l'ordre des PK : pas de tri a faire
+            if valeurs.dtype != object and bool(np.all(valeurs[1:] >= valeurs[:-1])):
+                permutation = np.arange(len(valeurs))
+            else:
+                permutation = np.argsort(valeurs, kind='stable')
+            self.tris[id(valeurs)] = permutation
+        self.layoutAboutToBeChanged.emit()
+        self.ordre = permutation[::-1] if ordre == Qt.DescendingOrder else permutation
+        self.layoutChanged.emit()
 
 class DialogAnomalies(QDialog):
     def __init__(self, type_anomalie, positions, parent=None):
@@ -31,18 +261,17 @@ class DialogAnomalies(QDialog):
         info.setFont(QFont("Arial", 11))
         layout.addWidget(info)
         
-        self.table = QTableWidget()
-        self.table.setColumnCount(2)
-        self.table.setHorizontalHeaderLabels(["Position PK (m)", "Distance depuis debut (km)"])
-        self.table.horizontalHeader().setStretchLastSection(True)
-        
-        self.table.setRowCount(len(positions))
-        for row, pk in enumerate(sorted(positions)):
-            self.table.setItem(row, 0, QTableWidgetItem(f"{pk:.2f}"))
-            km = pk / 1000
-            self.table.setItem(row, 1, QTableWidgetItem(f"{km:.3f}"))
+        self.modele = ModeleColonnes(["Position PK (m)", "Distance depuis debut (km)"],
+                                     [lambda pk: f"{pk:.2f}", lambda pk: f"{pk / 1000:.3f}"], self)
+        self.modele.remplacer([positions, positions])
         
+        self.table = QTableView()
+        self.table.setModel(self.modele)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        # Hauteur de ligne fixe : la vue ne mesure pas chaque ligne
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.table.setSortingEnabled(True)
+        self.table.sortByColumn(0, Qt.AscendingOrder)
         layout.addWidget(self.table)
         
         btn_close = QPushButton("Fermer")
@@ -57,8 +286,20 @@ class RailCheckApp(QMainWindow):
         self.setWindowTitle("RailCheck Mini - Eurailscout")
         self.setGeometry(100, 100, 1200, 800)
         
+        # Run analyse et visualise (un fichier de data/raw), commun aux onglets
+        central = QWidget()
+        central_layout = QVBoxLayout(central)
+        runs_layout = QHBoxLayout()
+        runs_layout.addWidget(QLabel("Run :"))
+        self.combo_runs = QComboBox()
+        self.combo_runs.setMinimumWidth(400)
+        runs_layout.addWidget(self.combo_runs)
+        runs_layout.addStretch()
+        central_layout.addLayout(runs_layout)
         self.tabs = QTabWidget()
-        self.setCentralWidget(self.tabs)
+        central_layout.addWidget(self.tabs)
+        self.setCentralWidget(central)
+        self.rafraichir_runs()
         
         self.onglet_generation = QWidget()
         self.onglet_analyse = QWidget()
@@ -71,6 +312,18 @@ class RailCheckApp(QMainWindow):
         self.setup_onglet_generation()
         self.setup_onglet_analyse()
         self.setup_onglet_visualisation()
+        
+        # Taches longues executees hors du thread de l'interface
+        self.pool = QThreadPool.globalInstance()
+        self.tache = None
+        self.barre_progression = QProgressBar()
+        self.barre_progression.setFixedWidth(200)
+        self.barre_progression.hide()
+        self.btn_annuler = QPushButton("Annuler")
+        self.btn_annuler.clicked.connect(self.annuler_tache)
+        self.btn_annuler.hide()
+        self.statusBar().addPermanentWidget(self.barre_progression)
+        self.statusBar().addPermanentWidget(self.btn_annuler)
     
     def setup_onglet_generation(self):
         layout = QVBoxLayout()
@@ -109,6 +362,23 @@ class RailCheckApp(QMainWindow):
         self.btn_analyser.clicked.connect(self.analyser_donnees)
         layout.addWidget(self.btn_analyser)
         
+        # Filtre par fenetre PK (vide = pas de borne)
+        filtre_layout = QHBoxLayout()
+        filtre_layout.addWidget(QLabel("Fenetre PK (m) :"))
+        self.edit_pk_min = QLineEdit()
+        self.edit_pk_min.setPlaceholderText("PK min")
+        self.edit_pk_min.setFixedWidth(120)
+        filtre_layout.addWidget(self.edit_pk_min)
+        self.edit_pk_max = QLineEdit()
+        self.edit_pk_max.setPlaceholderText("PK max")
+        self.edit_pk_max.setFixedWidth(120)
+        filtre_layout.addWidget(self.edit_pk_max)
+        self.label_fenetre = QLabel("")
+        self.label_fenetre.setStyleSheet("color: #666;")
+        filtre_layout.addWidget(self.label_fenetre)
+        filtre_layout.addStretch()
+        layout.addLayout(filtre_layout)
+        
         # KPIs en cartes simples
         kpi_layout = QHBoxLayout()
         kpi_layout.setSpacing(10)
@@ -170,11 +440,10 @@ class RailCheckApp(QMainWindow):
         hint.setStyleSheet("color: #666; font-style: italic;")
         layout.addWidget(hint)
         
-        self.table_anomalies = QTableWidget()
-        self.table_anomalies.setColumnCount(2)
-        self.table_anomalies.setHorizontalHeaderLabels(["Type anomalie", "Nombre"])
-        self.table_anomalies.setEditTriggers(QTableWidget.NoEditTriggers)
-        self.table_anomalies.setSelectionBehavior(QTableWidget.SelectRows)
+        self.modele_anomalies = ModeleColonnes(["Type anomalie", "Nombre"], [str, str], self)
+        self.table_anomalies = QTableView()
+        self.table_anomalies.setModel(self.modele_anomalies)
+        self.table_anomalies.setSelectionBehavior(QTableView.SelectRows)
         self.table_anomalies.doubleClicked.connect(self.voir_positions_anomalie)
         layout.addWidget(self.table_anomalies)
         
@@ -208,81 +477,130 @@ class RailCheckApp(QMainWindow):
         scroll.setWidget(scroll_widget)
         layout.addWidget(scroll)
         
+        self.graphiques = None
+        
         self.onglet_visualisation.setLayout(layout)
     
+    def construire_graphiques(self):
+        if self.graphiques is not None:
+            return self.graphiques
+        self.graphiques = GraphiquesMesures()
+        for titre_graphique, canvas in (
+                ("Evolution hauteur catenaire (norme EN 13848)", self.graphiques.canvas_hauteurs),
+                ("Repartition des anomalies detectees", self.graphiques.canvas_anomalies)):
+            titre = QLabel(titre_graphique)
+            titre.setFont(QFont("Arial", 13, QFont.Bold))
+            titre.setStyleSheet("background-color: #f5f5f5; padding: 8px; border-radius: 3px;")
+            self.scroll_layout.addWidget(titre)
+            canvas.setStyleSheet("border: 1px solid #ddd; background-color: white;")
+            self.scroll_layout.addWidget(canvas)
+        return self.graphiques
+    
+    def lancer_tache(self, fonction, sur_resultat):
+        # Une seule tache a la fois : les boutons d'action sont desactives jusqu'a sa fin
+        if self.tache is not None:
+            return
+        self.tache = Tache(fonction)
+        self.tache.signaux.progression.connect(self.afficher_progression)
+        self.tache.signaux.resultat.connect(sur_resultat)
+        self.tache.signaux.erreur.connect(self.afficher_erreur)
+        self.tache.signaux.fin.connect(self.tache_terminee)
+        for bouton in (self.btn_generer, self.btn_analyser, self.btn_visualiser):
+            bouton.setEnabled(False)
+        self.barre_progression.setValue(0)
+        self.barre_progression.show()
+        self.btn_annuler.show()
+        self.pool.start(self.tache)
+    
+    def afficher_progression(self, pourcentage, message):
+        self.barre_progression.setValue(pourcentage)
+        if message:
+            self.statusBar().showMessage(message)
+    
+    def afficher_erreur(self, message):
+        self.statusBar().showMessage(f"Erreur : {message}")
+    
+    def annuler_tache(self):
+        if self.tache is not None:
+            self.tache.annuler()
+            self.statusBar().showMessage("Annulation...")
+    
+    def tache_terminee(self):
+        if self.tache.annulee.is_set():
+            self.statusBar().showMessage("Operation annulee")
+        elif not self.tache.echec:
+            self.statusBar().clearMessage()
+        self.tache = None
+        for bouton in (self.btn_generer, self.btn_analyser, self.btn_visualiser):
+            bouton.setEnabled(True)
+        self.barre_progression.hide()
+        self.btn_annuler.hide()
+    
+    def closeEvent(self, event):
+        self.annuler_tache()
+        self.pool.waitForDone()
+        super().closeEvent(event)
+    
+    def rafraichir_runs(self, selection=None):
+        # Du plus recent au plus ancien ; garde le run choisi s'il existe toujours
+        selection = selection or self.combo_runs.currentData()
+        self.combo_runs.clear()
+        for chemin in lister_runs():
+            self.combo_runs.addItem(os.path.basename(chemin), chemin)
+        indice = self.combo_runs.findData(selection)
+        if indice >= 0:
+            self.combo_runs.setCurrentIndex(indice)
+    
+    def run_selectionne(self):
+        # None : fichier de mesures par defaut
+        return self.combo_runs.currentData()
+    
     def generer_donnees(self):
         self.log_generation.append("Debut generation...")
-        
-        data_generator.generer_donnees_ufm160(
-            debut=datetime(2024, 1, 15, 8, 0),
-            duree_heures=0.1,
-            nom_fichier="data/raw/mesures_ufm160.csv"
-        )
-        
-        fichier = open('data/raw/mesures_ufm160.csv', 'r', encoding='utf-8')
-        reader = csv.DictReader(fichier)
-        
-        total = 0
-        for ligne in reader:
-            total = total + 1
-        
-        fichier.close()
-        
-        self.log_generation.append(f"Fichier genere : {total} lignes")
+        self.lancer_tache(tache_generation, self.afficher_generation)
+    
+    def afficher_generation(self, resultat):
+        chemin, total = resultat
+        self.rafraichir_runs(chemin)
+        self.log_generation.append(f"Fichier genere : {chemin} ({total} lignes)")
         self.label_resultat.setText(f"Generation terminee : {total} mesures")
     
+    def fenetre_pk(self):
+        # Leve ValueError si une borne saisie n'est pas un nombre
+        pk_min = float(self.edit_pk_min.text()) if self.edit_pk_min.text().strip() else float('-inf')
+        pk_max = float(self.edit_pk_max.text()) if self.edit_pk_max.text().strip() else float('inf')
+        if pk_min == float('-inf') and pk_max == float('inf'):
+            return None
+        return pk_min, pk_max
+    
     def analyser_donnees(self):
-        fichier = open('data/raw/mesures_ufm160.csv', 'r', encoding='utf-8')
-        reader = csv.DictReader(fichier)
-        
-        total = 0
-        anomalies = 0
-        pk_min = 999999
-        pk_max = 0
-        compteur_anomalies = {}
-        self.positions_anomalies = {}
-        
-        for ligne in reader:
-            total = total + 1
-            
-            pk = float(ligne['pk_position'])
-            if pk < pk_min:
-                pk_min = pk
-            if pk > pk_max:
-                pk_max = pk
-            
-            if ligne['defaut_type']:
-                anomalies = anomalies + 1
-                type_anomalie = ligne['defaut_type']
-                pk_anomalie = pk
-                
-                if type_anomalie in compteur_anomalies:
-                    compteur_anomalies[type_anomalie] = compteur_anomalies[type_anomalie] + 1
-                else:
-                    compteur_anomalies[type_anomalie] = 1
-                    self.positions_anomalies[type_anomalie] = []
-                
-                self.positions_anomalies[type_anomalie].append(round(pk_anomalie, 2))
-        
-        fichier.close()
-        
-        distance = (pk_max - pk_min) / 1000
-        conformite = (total - anomalies) / total * 100
-        
-        self.label_distance.setText(f"{round(distance, 2)} km")
-        self.label_conformite.setText(f"{round(conformite, 2)}%")
-        self.label_anomalies.setText(f"{anomalies}")
-        
-        self.table_anomalies.setRowCount(len(compteur_anomalies))
-        row = 0
-        for type_anomalie, count in compteur_anomalies.items():
-            self.table_anomalies.setItem(row, 0, QTableWidgetItem(type_anomalie))
-            self.table_anomalies.setItem(row, 1, QTableWidgetItem(str(count)))
-            row = row + 1
+        try:
+            fenetre = self.fenetre_pk()
+        except ValueError:
+            self.label_fenetre.setText("Fenetre PK invalide")
+            return
+        chemin = self.run_selectionne()
+        self.lancer_tache(lambda tache: tache_analyse(tache, chemin, fenetre), self.afficher_analyse)
+    
+    def afficher_analyse(self, resultat):
+        kpis, fenetre = resultat
+        self.positions_anomalies = kpis.positions_anomalies
+        if fenetre is not None:
+            self.label_fenetre.setText(f"{fenetre[0]} mesures, {fenetre[1]} segments de 100 m")
+        else:
+            self.label_fenetre.setText("")
+        
+        self.label_distance.setText(f"{round(kpis.distance_km, 2)} km")
+        self.label_conformite.setText(f"{round(kpis.conformite, 2)}%")
+        self.label_anomalies.setText(f"{kpis.anomalies}")
+        
+        # Remplacement du modele en une seule notification a la vue
+        self.modele_anomalies.remplacer([np.array(list(kpis.compteur_anomalies.keys()), dtype=object),
+                                         np.array(list(kpis.compteur_anomalies.values()))])
     
     def voir_positions_anomalie(self, index):
         row = index.row()
-        type_anomalie = self.table_anomalies.item(row, 0).text()
+        type_anomalie = self.modele_anomalies.valeur(row, 0)
         
         if type_anomalie in self.positions_anomalies:
             positions = self.positions_anomalies[type_anomalie]
@@ -290,94 +608,13 @@ class RailCheckApp(QMainWindow):
             dialog.exec_()
     
     def visualiser_donnees(self):
-        fichier = open('data/raw/mesures_ufm160.csv', 'r', encoding='utf-8')
-        reader = csv.DictReader(fichier)
-        
-        hauteurs = []
-        positions = []
-        compteur_anomalies = {}
-        
-        count = 0
-        for ligne in reader:
-            if count < 500:
-                hauteurs.append(float(ligne['hauteur_catenaire']))
-                positions.append(float(ligne['pk_position']))
-            
-            if ligne['defaut_type']:
-                type_anomalie = ligne['defaut_type']
-                if type_anomalie in compteur_anomalies:
-                    compteur_anomalies[type_anomalie] = compteur_anomalies[type_anomalie] + 1
-                else:
-                    compteur_anomalies[type_anomalie] = 1
-            
-            count = count + 1
-        
-        fichier.close()
-        
-        # Nettoyer les anciens graphiques
-        while self.scroll_layout.count():
-            child = self.scroll_layout.takeAt(0)
-            if child.widget():
-                child.widget().deleteLater()
-        
-        # Graphique 1: Hauteur catenaire
-        titre1 = QLabel("Evolution hauteur catenaire (norme EN 13848)")
-        titre1.setFont(QFont("Arial", 13, QFont.Bold))
-        titre1.setStyleSheet("background-color: #f5f5f5; padding: 8px; border-radius: 3px;")
-        self.scroll_layout.addWidget(titre1)
-        
-        fig1, ax1 = plt.subplots(figsize=(11, 4.5))
-        ax1.plot(positions, hauteurs, linewidth=1, color='#2196f3', alpha=0.8)
-        ax1.axhline(y=5.5, color='#4caf50', linestyle='--', linewidth=1.5, label='Hauteur standard (5.5m)')
-        ax1.axhline(y=4.0, color='#f44336', linestyle='--', linewidth=1, alpha=0.6, label='Limite min (4.0m)')
-        ax1.axhline(y=7.0, color='#f44336', linestyle='--', linewidth=1, alpha=0.6, label='Limite max (7.0m)')
-        ax1.fill_between(positions, 4.0, 7.0, alpha=0.05, color='#4caf50')
-        ax1.set_xlabel('Position (m)', fontsize=11)
-        ax1.set_ylabel('Hauteur catenaire (m)', fontsize=11)
-        ax1.set_title('Mesures UFM 160', fontsize=12, fontweight='bold')
-        ax1.grid(True, alpha=0.3, linestyle=':')
-        ax1.legend(fontsize=9)
-        plt.tight_layout()
-        plt.savefig('data/graph_hauteurs.png', dpi=100, bbox_inches='tight')
-        plt.close(fig1)
-        
-        label_hauteurs = QLabel()
-        pixmap_hauteurs = QPixmap('data/graph_hauteurs.png')
-        label_hauteurs.setPixmap(pixmap_hauteurs)
-        label_hauteurs.setStyleSheet("border: 1px solid #ddd; background-color: white;")
-        self.scroll_layout.addWidget(label_hauteurs)
-        
-        # Graphique 2: Anomalies
-        titre2 = QLabel("Repartition des anomalies detectees")
-        titre2.setFont(QFont("Arial", 13, QFont.Bold))
-        titre2.setStyleSheet("background-color: #f5f5f5; padding: 8px; border-radius: 3px;")
-        self.scroll_layout.addWidget(titre2)
-        
-        fig2, ax2 = plt.subplots(figsize=(11, 4.5))
-        types = list(compteur_anomalies.keys())
-        counts = list(compteur_anomalies.values())
-        colors = ['#f44336', '#ff9800', '#ffc107']
-        bars = ax2.bar(types, counts, color=colors, edgecolor='#333', linewidth=1.2, alpha=0.85)
-        ax2.set_xlabel('Type anomalie', fontsize=11)
-        ax2.set_ylabel('Nombre', fontsize=11)
-        ax2.set_title('Inspection ferroviaire', fontsize=12, fontweight='bold')
-        ax2.grid(True, alpha=0.3, linestyle=':', axis='y')
-        
-        for bar in bars:
-            height = bar.get_height()
-            ax2.text(bar.get_x() + bar.get_width()/2., height,
-                    f'{int(height)}',
-                    ha='center', va='bottom', fontweight='bold', fontsize=11)
-        
-        plt.tight_layout()
-        plt.savefig('data/graph_anomalies.png', dpi=100, bbox_inches='tight')
-        plt.close(fig2)
-        
-        label_anomalies = QLabel()
-        pixmap_anomalies = QPixmap('data/graph_anomalies.png')
-        label_anomalies.setPixmap(pixmap_anomalies)
-        label_anomalies.setStyleSheet("border: 1px solid #ddd; background-color: white;")
-        self.scroll_layout.addWidget(label_anomalies)
+        chemin = self.run_selectionne()
+        self.lancer_tache(lambda tache: tache_visualisation(tache, chemin), self.afficher_graphiques)
+    
+    def afficher_graphiques(self, donnees):
+        graphiques = self.construire_graphiques()
+        graphiques.mettre_a_jour(*donnees)
+        graphiques.dessiner()
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
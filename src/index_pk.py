@@ -0,0 +1,176 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from data_generator import LONGUEUR_SEGMENT, gravite_libelle
+from dataset import Dataset
+
+
+class IndexPk:
+    # Index trie des PK d'un dataset : une fenetre [pk_min, pk_max] se resout par deux
+    # recherches dichotomiques. Les PK generes sont croissants : l'index est alors la
+    # colonne elle-meme, sans copie ; sinon un ordre de tri stable est calcule une fois.
+    def __init__(self, dataset: Dataset):
+        pk = dataset['pk_position']
+        if len(pk) < 2 or bool(np.all(pk[1:] >= pk[:-1])):
+            self.ordre: Optional[np.ndarray] = None
+            self.pk = pk
+        else:
+            self.ordre = np.argsort(pk, kind='stable')
+            self.pk = pk[self.ordre]
+
+    def bornes(self, pk_min: float, pk_max: float) -> slice:
+        # Rangs (dans l'ordre des PK) des mesures telles que pk_min <= pk <= pk_max
+        debut = int(np.searchsorted(self.pk, pk_min, side='left'))
+        fin = int(np.searchsorted(self.pk, pk_max, side='right'))
+        return slice(debut, max(debut, fin))
+
+    def extraire(self, colonne: np.ndarray, rangs: slice) -> np.ndarray:
+        if self.ordre is None:
+            return colonne[rangs]
+        return colonne[self.ordre[rangs]]
+
+
+def obtenir_index(dataset: Dataset) -> IndexPk:
+    return dataset.calculer('index_pk', IndexPk)
+
+
+def sous_dataset(dataset: Dataset, pk_min: float, pk_max: float) -> Dataset:
+    # Mesures de la fenetre, triees par PK. Cout O(log n) pour des PK croissants
+    # (les colonnes sont des vues), O(log n + k) sinon.
+    index = obtenir_index(dataset)
+    rangs = index.bornes(pk_min, pk_max)
+    colonnes = {nom: index.extraire(colonne, rangs) for nom, colonne in dataset.colonnes.items()}
+    return Dataset(colonnes, dataset.types_anomalies, dataset.chemin, dataset.version)
+
+
+@dataclass
+class Segment:
+    pk_debut: float
+    mesures: int
+    anomalies: int
+    compteur_anomalies: Dict[str, int]
+    hauteur_moyenne: float
+    hauteur_min: float
+    hauteur_max: float
+    compteur_gravites: Dict[str, int] = field(default_factory=dict)
+
+
+def compter_gravites(types_anomalies: List[str], compte) -> Dict[str, int]:
+    gravites: Dict[str, int] = {}
+    for nom, nombre in zip(types_anomalies, compte):
+        if nombre:
+            gravite = gravite_libelle(nom)
+            gravites[gravite] = gravites.get(gravite, 0) + int(nombre)
+    return gravites
+
+
+def resumer_segments(dataset: Dataset, longueur: float = LONGUEUR_SEGMENT) -> List[Segment]:
+    # Resume par segment de `longueur` metres d'un dataset trie par PK, en O(k)
+    if len(dataset) == 0:
+        return []
+    pk = dataset['pk_position']
+    hauteurs = dataset['hauteur_catenaire']
+    codes = dataset['defaut_type']
+
+    numeros = np.floor_divide(pk, longueur).astype(np.int64)
+    premiers = np.flatnonzero(np.r_[True, numeros[1:] != numeros[:-1]])
+    nombres = np.diff(np.r_[premiers, len(pk)])
+    sommes = np.add.reduceat(hauteurs, premiers)
+    minimums = np.minimum.reduceat(hauteurs, premiers)
+    maximums = np.maximum.reduceat(hauteurs, premiers)
+
+    # Comptage par (segment, type) : une seule passe bincount sur un indice combine
+    types = len(dataset.types_anomalies)
+    segment_ligne = np.repeat(np.arange(len(premiers)), nombres)
+    lignes_anomalies = codes >= 0
+    comptes = np.bincount(segment_ligne[lignes_anomalies] * types + codes[lignes_anomalies],
+                          minlength=len(premiers) * types).reshape(len(premiers), types)
+
+    return [
+        Segment(
+            pk_debut=float(numeros[premier] * longueur),
+            mesures=int(nombre),
+            anomalies=int(compte.sum()),
+            compteur_anomalies={nom: int(n) for nom, n in zip(dataset.types_anomalies, compte) if n},
+            hauteur_moyenne=float(somme / nombre),
+            hauteur_min=float(minimum),
+            hauteur_max=float(maximum),
+            compteur_gravites=compter_gravites(dataset.types_anomalies, compte),
+        )
+        for premier, nombre, somme, minimum, maximum, compte
+        in zip(premiers, nombres, sommes, minimums, maximums, comptes)
+    ]
+
+
+def lister_anomalies(dataset: Dataset) -> List[Dict[str, Any]]:
+    lignes = np.flatnonzero(dataset['defaut_type'] >= 0)
+    return [
+        {'pk': round(float(pk), 3), 'type': dataset.types_anomalies[code],
+         'position': round(float(position), 3)}
+        for pk, code, position in zip(dataset['pk_position'][lignes],
+                                      dataset['defaut_type'][lignes],
+                                      dataset['defaut_position'][lignes])
+    ]
+
+
+class IndexAnomalies:
+    # Lignes des anomalies regroupees par type, triees par (PK, ligne) dans chaque type.
+    # Une page se lit par recherche dichotomique dans les types demandes, sans construire la
+    # liste complete : le curseur est la ligne de la derniere anomalie servie.
+    def __init__(self, dataset: Dataset):
+        codes = dataset['defaut_type']
+        lignes = np.flatnonzero(codes >= 0)
+        pk = dataset['pk_position'][lignes]
+        ordre = np.lexsort((lignes, pk, codes[lignes]))
+        self.lignes = lignes[ordre]
+        self.pk = pk[ordre]
+        compte = np.bincount(codes[lignes], minlength=len(dataset.types_anomalies))
+        self.debuts = np.r_[0, np.cumsum(compte)]
+        self.types_anomalies = dataset.types_anomalies
+        self.pk_colonne = dataset['pk_position']
+
+    def codes(self, types: Optional[List[str]] = None, gravites: Optional[List[str]] = None) -> List[int]:
+        # Types retenus par les deux filtres (None : pas de filtre)
+        return [code for code, nom in enumerate(self.types_anomalies)
+                if (types is None or nom in types)
+                and (gravites is None or gravite_libelle(nom) in gravites)]
+
+    def _bornes(self, code: int, pk_min: float, pk_max: float) -> Tuple[int, int]:
+        debut, fin = self.debuts[code], self.debuts[code + 1]
+        pk = self.pk[debut:fin]
+        return (int(debut + np.searchsorted(pk, pk_min, side='left')),
+                int(debut + np.searchsorted(pk, pk_max, side='right')))
+
+    def _apres(self, debut: int, fin: int, apres: int) -> int:
+        # Premier rang de [debut, fin) strictement apres la ligne `apres` dans l'ordre (PK, ligne)
+        pk_curseur = self.pk_colonne[apres]
+        pk = self.pk[debut:fin]
+        egaux = slice(debut + int(np.searchsorted(pk, pk_curseur, side='left')),
+                      debut + int(np.searchsorted(pk, pk_curseur, side='right')))
+        return egaux.start + int(np.searchsorted(self.lignes[egaux], apres, side='right'))
+
+    def page(self, codes: List[int], pk_min: float = float('-inf'), pk_max: float = float('inf'),
+             apres: Optional[int] = None, limite: int = 1000) -> Tuple[np.ndarray, int, Optional[int]]:
+        # (lignes de la page, total selectionne, curseur de la page suivante ou None).
+        # O(types * (log n + limite)). IndexError si le curseur n'est pas une ligne du dataset
+        if apres is not None and not 0 <= apres < len(self.pk_colonne):
+            raise IndexError(apres)
+        total = restantes = 0
+        candidates = []
+        for code in codes:
+            debut, fin = self._bornes(code, pk_min, pk_max)
+            total += fin - debut
+            if apres is not None:
+                debut = max(debut, self._apres(debut, fin, apres))
+            restantes += fin - debut
+            candidates.append(self.lignes[debut:min(fin, debut + limite)])
+        lignes = np.concatenate(candidates) if candidates else np.zeros(0, dtype=np.int64)
+        lignes = lignes[np.lexsort((lignes, self.pk_colonne[lignes]))][:limite]
+        suivant = int(lignes[-1]) if restantes > len(lignes) and len(lignes) else None
+        return lignes, total, suivant
+
+
+def obtenir_index_anomalies(dataset: Dataset) -> IndexAnomalies:
+    return dataset.calculer('index_anomalies', IndexAnomalies)
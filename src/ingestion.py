@@ -0,0 +1,316 @@
+import io
+import os
+import json
+import mmap
+import time
+import zlib
+import threading
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import dataset
+import data_generator
+from analytics import AgregatsCourants, Kpis
+from segments import PyramideSegments
+from depassements import COLONNES_SURVEILLEES, DetecteurDepassements, Depassements
+from metriques import enregistrer_lecture
+
+TAILLE_EMPREINTE = 256  # octets de debut de fichier compares pour detecter une reecriture
+SUFFIXE_ETAT = '.agregats.npz'  # etat du suivi, enregistre a cote du fichier de mesures
+INTERVALLE_SAUVEGARDE = 30.0  # secondes au moins entre deux enregistrements de l'etat
+# Colonnes lues dans un fichier .ufmb : agregats, segments et controle des tolerances
+COLONNES_SUIVIES = {'timestamp', 'pk_position', 'hauteur_catenaire', 'defaut_type',
+                    *COLONNES_SURVEILLEES}
+
+
+class SuiviFichier:
+    # Suit un CSV de mesures alimente en continu : seules les lignes completes ajoutees
+    # depuis le dernier appel sont lues. Une troncature, une rotation (autre inode) ou une
+    # reecriture (debut du fichier different) repart de zero. Un fichier .ufmb est suivi
+    # par le nombre de lignes de son en-tete. Un CSV compresse ne se lit pas a partir d'une
+    # position : il est relu en entier quand il change (il doit etre ecrit puis renomme).
+    # Avec persister=True, l'etat (position, agregats, pyramide de segments, detecteur de
+    # depassements) est enregistre a cote du fichier et repris au redemarrage si le fichier
+    # n'a pas ete reecrit. L'enregistrement recrit tout l'etat, dont le cout suit la longueur
+    # du fichier et non celle du lot : il est fait au plus toutes les intervalle_sauvegarde
+    # secondes, et a l'arret (terminer). Apres un arret brutal, la reprise relit les lignes
+    # ajoutees depuis le dernier enregistrement.
+    def __init__(self, chemin: Optional[str] = None, persister: bool = True,
+                 intervalle_sauvegarde: float = INTERVALLE_SAUVEGARDE):
+        self.chemin_fixe = chemin
+        self.persister = persister
+        self.intervalle_sauvegarde = intervalle_sauvegarde
+        self.derniere_sauvegarde = float('-inf')
+        self.a_sauvegarder = False
+        self.verrou = threading.Lock()
+        self.generation = 0
+        self.reinitialiser()
+
+    def reinitialiser(self) -> None:
+        self.chemin = None
+        self.inode = None
+        self.position = 0
+        self.empreinte = b''
+        self.modification: Optional[float] = None
+        self.agregats = AgregatsCourants()
+        self.pyramide = PyramideSegments()
+        self.detecteur = DetecteurDepassements()
+        self.generation += 1
+
+    def version(self) -> str:
+        # Identifie le contenu ingere (debut du fichier et position atteinte) : identique d'un
+        # processus a l'autre pour un meme fichier, contrairement a `generation`
+        return f"{zlib.crc32(self.empreinte):08x}-{self.position:x}"
+
+    def _ingerer(self, colonnes: Dict[str, np.ndarray], types_anomalies) -> None:
+        self.agregats.ajouter(colonnes, types_anomalies)
+        self.pyramide.ajouter(colonnes, types_anomalies)
+        self.detecteur.ajouter(colonnes)
+        self.generation += 1
+        self.a_sauvegarder = True
+
+    def _sauvegarder_periodiquement(self) -> None:
+        if time.monotonic() - self.derniere_sauvegarde >= self.intervalle_sauvegarde:
+            self.sauvegarder()
+
+    def sauvegarder(self) -> None:
+        if not self.persister or self.chemin is None:
+            return
+        self.derniere_sauvegarde = time.monotonic()
+        self.a_sauvegarder = False
+        etat = self.pyramide.etat()
+        etat.update(self.detecteur.etat())
+        etat['position'] = np.array(self.position)
+        etat['empreinte'] = np.frombuffer(self.empreinte, dtype=np.uint8)
+        etat['agregats'] = np.array(json.dumps(self.agregats.etat()))
+        temporaire = f"{self.chemin}{SUFFIXE_ETAT}.{os.getpid()}.tmp"
+        try:
+            with open(temporaire, 'wb') as fichier:
+                np.savez(fichier, **etat)
+            os.replace(temporaire, self.chemin + SUFFIXE_ETAT)
+        except OSError:
+            # Dossier en lecture seule : le suivi continue, sans reprise possible
+            pass
+
+    def _restaurer(self, empreinte_valide) -> None:
+        # empreinte_valide(empreinte, position) : l'etat enregistre correspond-il au fichier ?
+        if not self.persister:
+            return
+        try:
+            with np.load(self.chemin + SUFFIXE_ETAT) as etat:
+                empreinte = etat['empreinte'].tobytes()
+                position = int(etat['position'])
+                if not empreinte or not empreinte_valide(empreinte, position):
+                    return
+                # Lus en premier : un etat d'une version precedente ne restaure rien
+                agregats = AgregatsCourants.depuis_etat(json.loads(str(etat['agregats'])))
+                self.pyramide.restaurer(etat)
+                self.detecteur.restaurer(etat)
+        except (OSError, ValueError, KeyError):
+            return
+        self.agregats = agregats
+        self.position = position
+        self.empreinte = empreinte
+
+    def _doit_reprendre(self, chemin: str, infos: os.stat_result) -> bool:
+        if chemin != self.chemin or (infos.st_dev, infos.st_ino) != self.inode:
+            return True
+        if infos.st_size < self.position:
+            return True
+        return self._debut_fichier(chemin, len(self.empreinte)) != self.empreinte
+
+    @staticmethod
+    def _debut_fichier(chemin: str, taille: int) -> bytes:
+        with open(chemin, 'rb') as fichier:
+            return fichier.read(taille)
+
+    def lire_nouveautes(self) -> int:
+        # Renvoie le nombre de mesures ingerees
+        chemin = self.chemin_fixe or dataset.CHEMIN_MESURES
+        if data_generator.est_binaire(chemin):
+            return self._lire_nouveautes_binaire(chemin)
+        if data_generator.compression(chemin) is not None:
+            return self._lire_nouveautes_compresse(chemin)
+        with self.verrou:
+            infos = os.stat(chemin)
+            if self._doit_reprendre(chemin, infos):
+                self.reinitialiser()
+                self.chemin = chemin
+                self.inode = (infos.st_dev, infos.st_ino)
+                self._restaurer(lambda empreinte, position: position <= infos.st_size
+                                and self._debut_fichier(chemin, len(empreinte)) == empreinte)
+            if self.modification is None:
+                self.modification = infos.st_mtime
+            if infos.st_size == self.position:
+                return 0
+
+            with open(chemin, 'rb') as fichier:
+                if len(self.empreinte) < TAILLE_EMPREINTE:
+                    self.empreinte = fichier.read(TAILLE_EMPREINTE)
+                fichier.seek(self.position)
+                octets = fichier.read(infos.st_size - self.position)
+
+            # Une ligne en cours d'ecriture sera lue au prochain appel
+            fin = octets.rfind(b'\n') + 1
+            if fin == 0:
+                return 0
+            entete = self.position == 0
+            debut = time.perf_counter()
+            colonnes, types = dataset.parser_colonnes(
+                io.StringIO(octets[:fin].decode('utf-8')), entete=entete)
+            enregistrer_lecture('suivi_csv', len(colonnes['pk_position']), fin, time.perf_counter() - debut)
+            self.position += fin
+            self.modification = infos.st_mtime
+            self._ingerer(colonnes, types)
+            self._sauvegarder_periodiquement()
+            return len(colonnes['pk_position'])
+
+    def _lire_nouveautes_binaire(self, chemin: str) -> int:
+        # L'en-tete donne le nombre de lignes deja ecrites ; son identifiant change a
+        # chaque nouveau fichier
+        with self.verrou, open(chemin, 'rb') as fichier:
+            entete = data_generator.lire_entete_binaire(fichier)
+            identifiant = entete['identifiant'].encode('ascii')
+            if chemin != self.chemin or identifiant != self.empreinte \
+                    or entete['nombre'] < self.position:
+                self.reinitialiser()
+                self.chemin = chemin
+                self.empreinte = identifiant
+                self._restaurer(lambda empreinte, position: empreinte == identifiant
+                                and position <= entete['nombre'])
+            if self.modification is None or entete['nombre'] > self.position:
+                self.modification = os.fstat(fichier.fileno()).st_mtime
+            nombre = entete['nombre'] - self.position
+            if nombre == 0:
+                return 0
+
+            debut = time.perf_counter()
+            with mmap.mmap(fichier.fileno(), 0, access=mmap.ACCESS_READ) as carte:
+                colonnes = {nom: np.frombuffer(carte, dtype=dtype, count=nombre,
+                                               offset=position + self.position * np.dtype(dtype).itemsize)
+                            for nom, dtype, position in entete['colonnes']
+                            if nom in COLONNES_SUIVIES}
+                octets = sum(colonne.nbytes for colonne in colonnes.values())
+                self._ingerer(colonnes, entete['types_anomalies'])
+                del colonnes
+            enregistrer_lecture('suivi_binaire', nombre, octets, time.perf_counter() - debut)
+            self.position = entete['nombre']
+            self._sauvegarder_periodiquement()
+            return nombre
+
+    def _lire_nouveautes_compresse(self, chemin: str) -> int:
+        # Signature (inode, taille, date) a la place du debut du fichier ; la position est le
+        # nombre de mesures lues
+        with self.verrou:
+            infos = os.stat(chemin)
+            signature = f"{infos.st_dev}:{infos.st_ino}:{infos.st_size}:{infos.st_mtime_ns}".encode('ascii')
+            if chemin == self.chemin and signature == self.empreinte:
+                return 0
+            if chemin != self.chemin:
+                self.reinitialiser()
+                self.chemin = chemin
+                self._restaurer(lambda empreinte, position: empreinte == signature)
+                if self.empreinte == signature:
+                    self.modification = infos.st_mtime
+                    return 0
+
+            # Lu en entier avant de remplacer l'etat : un fichier illisible (en cours
+            # d'ecriture) laisse les agregats precedents en place
+            debut = time.perf_counter()
+            with data_generator.ouvrir_texte(chemin) as source:
+                colonnes, types = dataset.parser_colonnes(source)
+            nombre = len(colonnes['pk_position'])
+            enregistrer_lecture(dataset.format_lecture(chemin), nombre, infos.st_size,
+                                time.perf_counter() - debut)
+            self.reinitialiser()
+            self.chemin = chemin
+            self.empreinte = signature
+            self.position = nombre
+            self.modification = infos.st_mtime
+            self._ingerer(colonnes, types)
+            self._sauvegarder_periodiquement()
+            return nombre
+
+    def terminer(self) -> None:
+        # Enregistre l'etat si des mesures ont ete ingerees depuis le dernier enregistrement
+        with self.verrou:
+            if self.a_sauvegarder:
+                self.sauvegarder()
+
+    def kpis(self) -> Kpis:
+        with self.verrou:
+            return self.agregats.kpis()
+
+    def instantane(self) -> Tuple[int, Kpis, PyramideSegments, str, Optional[float], Depassements]:
+        # Copie coherente de l'etat courant, numerotee par generation
+        with self.verrou:
+            return (self.generation, self.agregats.kpis(), self.pyramide.copie(), self.version(),
+                    self.modification, self.detecteur.instantane())
+
+
+class Instantane(NamedTuple):
+    kpis: Kpis
+    pyramide: PyramideSegments
+    horodatage: Optional[float]  # dernier rafraichissement reussi
+    version: str = ''  # SuiviFichier.version() des agregats publies
+    modification: Optional[float] = None  # mtime du fichier lors de la derniere ingestion
+    depassements: Depassements = Depassements()
+
+
+class Rafraichisseur:
+    # Fait avancer un SuiviFichier dans un thread de fond et publie un instantane des KPIs.
+    # L'instantane (kpis, pyramide, depassements, horodatage, version) est remplace d'un
+    # seul coup : un lecteur ne voit jamais un melange de deux rafraichissements.
+    def __init__(self, suivi: SuiviFichier, intervalle: float = 1.0):
+        self.suivi = suivi
+        self.intervalle = intervalle
+        self.instantane = Instantane(Kpis(0, 0.0, 0.0, 0), PyramideSegments(), None)
+        self.generation = None
+        self.derniere_erreur: Optional[Exception] = None
+        self.arret = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.verrou = threading.Lock()
+
+    def rafraichir(self) -> bool:
+        try:
+            self.suivi.lire_nouveautes()
+        except (OSError, ValueError) as erreur:
+            # Fichier absent ou ligne illisible : l'instantane precedent reste publie
+            self.derniere_erreur = erreur
+            return False
+        kpis, pyramide, _, version, modification, depassements = self.instantane
+        if self.suivi.generation != self.generation:
+            # La pyramide n'est copiee que si des mesures ont ete ingerees
+            (self.generation, kpis, pyramide, version, modification,
+             depassements) = self.suivi.instantane()
+        self.instantane = Instantane(kpis, pyramide, time.time(), version, modification, depassements)
+        self.derniere_erreur = None
+        return True
+
+    def demarrer(self) -> None:
+        with self.verrou:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.arret.clear()
+            self.rafraichir()
+            self.thread = threading.Thread(target=self._boucle, name='railcheck-rafraichissement',
+                                           daemon=True)
+            self.thread.start()
+
+    def arreter(self) -> None:
+        self.arret.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.suivi.terminer()
+
+    def _boucle(self) -> None:
+        while not self.arret.wait(self.intervalle):
+            self.rafraichir()
+
+    def age(self) -> float:
+        # Secondes ecoulees depuis le dernier rafraichissement reussi
+        horodatage = self.instantane.horodatage
+        if horodatage is None:
+            return float('nan')
+        return time.time() - horodatage
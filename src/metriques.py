@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from typing import Optional
+
+from prometheus_client import Counter as CompteurPrometheus, Histogram, Summary
+
+# Metriques de fonctionnement, enregistrees sur le REGISTRY par defaut (exposees par /metrics)
+DUREE_REQUETES = Histogram(
+    'railcheck_requete_duree_secondes', 'Duree de traitement des requetes HTTP',
+    ['route', 'methode', 'statut'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+LIGNES_LUES = CompteurPrometheus('railcheck_lignes_lues_total', 'Mesures lues dans les fichiers',
+                                 ['format'])
+OCTETS_LUS = CompteurPrometheus('railcheck_octets_lus_total', 'Octets de fichier de mesures lus',
+                                ['format'])
+DUREE_LECTURE = Summary('railcheck_lecture_duree_secondes', 'Duree de lecture des fichiers de mesures',
+                        ['format'])
+CACHE_DATASET = CompteurPrometheus('railcheck_cache_dataset_total', 'Acces au cache des datasets',
+                                   ['resultat'])
+CACHE_REPONSES = CompteurPrometheus('railcheck_cache_reponses_total',
+                                    'Reponses JSON servies : inchange (304), memoire ou calcul',
+                                    ['resultat'])
+
+# Profilage par echantillonnage des requetes lentes (desactive par defaut)
+PROFILAGE = os.environ.get('RAILCHECK_PROFILAGE', '') not in ('', '0')
+SEUIL_PROFILAGE = float(os.environ.get('RAILCHECK_PROFILAGE_SEUIL_MS', '100')) / 1000
+INTERVALLE_ECHANTILLONNAGE = float(os.environ.get('RAILCHECK_PROFILAGE_INTERVALLE_MS', '5')) / 1000
+DOSSIER_PROFILS = os.environ.get('RAILCHECK_PROFILS', 'data/profils')
+
+
+def enregistrer_lecture(format_fichier: str, lignes: int, octets: int, duree: float) -> None:
+    LIGNES_LUES.labels(format_fichier).inc(lignes)
+    OCTETS_LUS.labels(format_fichier).inc(octets)
+    DUREE_LECTURE.labels(format_fichier).observe(duree)
+
+
+class Echantillonneur:
+    # Releve la pile d'un thread toutes les `intervalle` secondes depuis un thread annexe.
+    # Les piles sont comptees au format "replie" (f1;f2;f3 N) lu par flamegraph.pl et speedscope.
+    def __init__(self, thread_id: int, intervalle: float = INTERVALLE_ECHANTILLONNAGE):
+        self.thread_id = thread_id
+        self.intervalle = intervalle
+        self.piles = Counter()
+        self.arret = threading.Event()
+        self.thread = threading.Thread(target=self._boucle, name='railcheck-profilage', daemon=True)
+
+    def demarrer(self) -> 'Echantillonneur':
+        self.thread.start()
+        return self
+
+    def arreter(self) -> None:
+        self.arret.set()
+        self.thread.join()
+
+    def _boucle(self) -> None:
+        while not self.arret.wait(self.intervalle):
+            cadre = sys._current_frames().get(self.thread_id)
+            pile = []
+            while cadre is not None:
+                code = cadre.f_code
+                pile.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                cadre = cadre.f_back
+            if pile:
+                self.piles[';'.join(reversed(pile))] += 1
+
+    def ecrire(self, chemin: str) -> None:
+        os.makedirs(os.path.dirname(chemin) or '.', exist_ok=True)
+        with open(chemin, 'w', encoding='utf-8') as fichier:
+            for pile, nombre in self.piles.most_common():
+                fichier.write(f"{pile} {nombre}\n")
+
+
+def installer_instrumentation(app, profilage: Optional[bool] = None) -> None:
+    # Histogramme de duree par route pour toutes les requetes de l'application Flask et,
+    # si le profilage est actif, piles echantillonnees des requetes plus lentes que le seuil
+    from flask import g, request
+
+    profilage = PROFILAGE if profilage is None else profilage
+
+    @app.before_request
+    def _debut_requete():
+        g.debut_requete = time.perf_counter()
+        if profilage:
+            g.echantillonneur = Echantillonneur(threading.get_ident()).demarrer()
+
+    @app.after_request
+    def _fin_requete(reponse):
+        # Duree mesuree a la fermeture de la reponse : un corps produit en flux (generateur,
+        # /anomalies/list) est compte jusqu'a son dernier morceau, pas seulement ses en-tetes
+        debut = g.debut_requete
+        # Motif de la route (et non l'URL) : pas d'explosion du nombre de series
+        route = request.url_rule.rule if request.url_rule is not None else 'inconnue'
+        etiquettes = (route, request.method, str(reponse.status_code))
+        echantillonneur = g.pop('echantillonneur', None)
+
+        def terminer():
+            duree = time.perf_counter() - debut
+            DUREE_REQUETES.labels(*etiquettes).observe(duree)
+            if echantillonneur is not None:
+                echantillonneur.arreter()
+                if duree >= SEUIL_PROFILAGE and echantillonneur.piles:
+                    nom = route.strip('/').replace('/', '_') or 'racine'
+                    echantillonneur.ecrire(os.path.join(
+                        DOSSIER_PROFILS, f"{time.strftime('%Y%m%d-%H%M%S')}_{nom}_{duree * 1000:.0f}ms.folded"))
+
+        reponse.call_on_close(terminer)
+        return reponse
+
+    @app.teardown_request
+    def _nettoyer_requete(erreur):
+        # Requete interrompue par une exception : after_request n'a pas arrete l'echantillonneur
+        echantillonneur = g.pop('echantillonneur', None)
+        if echantillonneur is not None:
+            echantillonneur.arreter()
@@ -0,0 +1,147 @@
+import copy
+import json
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from data_generator import LONGUEUR_SEGMENT
+from index_pk import Segment, compter_gravites
+
+NIVEAUX = (LONGUEUR_SEGMENT, LONGUEUR_SEGMENT * 10, LONGUEUR_SEGMENT * 100)  # 100 m, 1 km, 10 km
+SEGMENTS_MAX = 1000  # segments renvoyes au plus quand le niveau est choisi automatiquement
+
+
+class NiveauSegments:
+    # Agregats par segment de `longueur` metres. Les tableaux couvrent les segments
+    # origine, origine + 1, ... et s'etendent quand une mesure tombe en dehors.
+    def __init__(self, longueur: float):
+        self.longueur = longueur
+        self.origine = 0
+        self.nombre = np.zeros(0, dtype=np.int64)
+        self.hauteur_somme = np.zeros(0)
+        self.hauteur_min = np.zeros(0)
+        self.hauteur_max = np.zeros(0)
+        self.anomalies = np.zeros((0, 0), dtype=np.int64)  # segments x types d'anomalies
+
+    def _etendre(self, premier: int, dernier: int, types: int) -> None:
+        if len(self.nombre) == 0:
+            self.origine = premier
+        avant = max(self.origine - premier, 0)
+        apres = max(dernier - (self.origine + len(self.nombre) - 1), 0)
+        if avant or apres:
+            marges = (avant, apres)
+            self.nombre = np.pad(self.nombre, marges)
+            self.hauteur_somme = np.pad(self.hauteur_somme, marges)
+            self.hauteur_min = np.pad(self.hauteur_min, marges, constant_values=np.inf)
+            self.hauteur_max = np.pad(self.hauteur_max, marges, constant_values=-np.inf)
+            self.anomalies = np.pad(self.anomalies, (marges, (0, 0)))
+            self.origine -= avant
+        if types > self.anomalies.shape[1]:
+            self.anomalies = np.pad(self.anomalies, ((0, 0), (0, types - self.anomalies.shape[1])))
+
+    def ajouter(self, pk: np.ndarray, hauteurs: np.ndarray, codes: np.ndarray, types: int) -> None:
+        numeros = np.floor_divide(pk, self.longueur).astype(np.int64)
+        self._etendre(int(numeros.min()), int(numeros.max()), types)
+        indices = numeros - self.origine
+
+        # Les mesures arrivent triees par PK en pratique : pas de tri a faire
+        if np.any(indices[1:] < indices[:-1]):
+            ordre = np.argsort(indices, kind='stable')
+            indices, hauteurs, codes = indices[ordre], hauteurs[ordre], codes[ordre]
+        premiers = np.flatnonzero(np.r_[True, indices[1:] != indices[:-1]])
+        segments = indices[premiers]
+
+        self.nombre[segments] += np.diff(np.r_[premiers, len(indices)])
+        self.hauteur_somme[segments] += np.add.reduceat(hauteurs, premiers)
+        self.hauteur_min[segments] = np.minimum(self.hauteur_min[segments],
+                                                np.minimum.reduceat(hauteurs, premiers))
+        self.hauteur_max[segments] = np.maximum(self.hauteur_max[segments],
+                                                np.maximum.reduceat(hauteurs, premiers))
+        lignes_anomalies = codes >= 0
+        np.add.at(self.anomalies, (indices[lignes_anomalies], codes[lignes_anomalies]), 1)
+
+    def fenetre(self, pk_min: float, pk_max: float) -> slice:
+        debut = int(np.floor(max(pk_min, -1e18) / self.longueur)) - self.origine
+        fin = int(np.floor(min(pk_max, 1e18) / self.longueur)) - self.origine + 1
+        return slice(min(max(debut, 0), len(self.nombre)), min(max(fin, 0), len(self.nombre)))
+
+    def compter(self, pk_min: float, pk_max: float) -> int:
+        return int(np.count_nonzero(self.nombre[self.fenetre(pk_min, pk_max)]))
+
+
+class PyramideSegments:
+    # Agregats par segment a plusieurs resolutions (NIVEAUX), tenus a jour lot par lot :
+    # un lot de k mesures coute O(k) quelle que soit la longueur deja parcourue.
+    def __init__(self, longueurs=NIVEAUX):
+        self.types_anomalies: List[str] = []
+        self.niveaux = [NiveauSegments(longueur) for longueur in longueurs]
+
+    def ajouter(self, colonnes: Dict[str, np.ndarray], types_anomalies: List[str]) -> None:
+        if len(colonnes['pk_position']) == 0:
+            return
+        # Les codes du lot sont renumerotes selon les types connus de la pyramide
+        for nom in types_anomalies:
+            if nom not in self.types_anomalies:
+                self.types_anomalies.append(nom)
+        correspondance = np.array([self.types_anomalies.index(nom) for nom in types_anomalies] + [-1],
+                                  dtype=np.int64)
+        codes = correspondance[colonnes['defaut_type']]
+        for niveau in self.niveaux:
+            niveau.ajouter(colonnes['pk_position'], colonnes['hauteur_catenaire'], codes,
+                           len(self.types_anomalies))
+
+    def niveau(self, longueur: Optional[float] = None, pk_min: float = float('-inf'),
+               pk_max: float = float('inf'), segments_max: int = SEGMENTS_MAX) -> NiveauSegments:
+        # Niveau demande, sinon le plus fin dont la fenetre tient en segments_max segments
+        # (a defaut, le plus grossier)
+        if longueur is not None:
+            for niveau in self.niveaux:
+                if niveau.longueur == longueur:
+                    return niveau
+            raise ValueError(f"Niveau inconnu : {longueur} m (disponibles : "
+                             f"{', '.join(f'{n.longueur:g}' for n in self.niveaux)})")
+        for niveau in self.niveaux:
+            if niveau.compter(pk_min, pk_max) <= segments_max:
+                return niveau
+        return self.niveaux[-1]
+
+    def resumer(self, niveau: NiveauSegments, pk_min: float = float('-inf'),
+                pk_max: float = float('inf')) -> List[Segment]:
+        fenetre = niveau.fenetre(pk_min, pk_max)
+        resultat = []
+        for indice in np.flatnonzero(niveau.nombre[fenetre]) + fenetre.start:
+            nombre = int(niveau.nombre[indice])
+            compte = niveau.anomalies[indice]
+            compteur = {nom: int(n) for nom, n in zip(self.types_anomalies, compte) if n}
+            resultat.append(Segment(
+                pk_debut=float((niveau.origine + indice) * niveau.longueur),
+                mesures=nombre,
+                anomalies=sum(compteur.values()),
+                compteur_anomalies=compteur,
+                hauteur_moyenne=float(niveau.hauteur_somme[indice] / nombre),
+                hauteur_min=float(niveau.hauteur_min[indice]),
+                hauteur_max=float(niveau.hauteur_max[indice]),
+                compteur_gravites=compter_gravites(self.types_anomalies, compte),
+            ))
+        return resultat
+
+    def copie(self) -> 'PyramideSegments':
+        return copy.deepcopy(self)
+
+    def etat(self) -> Dict[str, np.ndarray]:
+        # Tableaux a passer a np.savez
+        etat = {'types_anomalies': np.array(json.dumps(self.types_anomalies))}
+        for niveau in self.niveaux:
+            prefixe = f'niveau_{niveau.longueur:g}_'
+            etat[prefixe + 'origine'] = np.array(niveau.origine)
+            for nom in ('nombre', 'hauteur_somme', 'hauteur_min', 'hauteur_max', 'anomalies'):
+                etat[prefixe + nom] = getattr(niveau, nom)
+        return etat
+
+    def restaurer(self, etat) -> None:
+        self.types_anomalies = json.loads(str(etat['types_anomalies']))
+        for niveau in self.niveaux:
+            prefixe = f'niveau_{niveau.longueur:g}_'
+            niveau.origine = int(etat[prefixe + 'origine'])
+            for nom in ('nombre', 'hauteur_somme', 'hauteur_min', 'hauteur_max', 'anomalies'):
+                setattr(niveau, nom, etat[prefixe + nom])
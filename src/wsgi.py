@@ -0,0 +1,5 @@
+# Point d'entree WSGI de production (depuis la racine) : gunicorn -c gunicorn.conf.py wsgi:app
+from api import app
+
+# Les donnees sont chargees par chaque worker des son demarrage (post_worker_init de
+# gunicorn.conf.py) ; sous un autre serveur, le premier appel a /ready ou a une route les charge